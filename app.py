@@ -1,10 +1,36 @@
 import streamlit as st
 import pandas as pd
-import json
 import io
 from datetime import datetime
+from functools import partial
 import xlsxwriter
 
+from billing_engine import (
+    aggregate_billing,
+    apply_column_plan,
+    build_account_index,
+    cached_column_plan,
+    compact_usage_frame,
+    consolidate_accounts,
+    ingest_columns,
+    input_totals,
+    is_normalized,
+    normalize_metrics,
+    read_usage_csv,
+    read_usage_xlsx,
+    ReportFile,
+    result_cache,
+    stream_usage_csv,
+    write_consolidated_sheet
+)
+from billing_rules import billing_rules_version
+from billing_ui import render_bulk_assignment, render_diagnostics, render_report_progress, upload_hash
+from diagnostics import span, start_recording, stop_recording
+from mapping_store import get_mapping_store
+from pipeline import apply_assignments, BillingPipeline
+from report_jobs import report_jobs
+from usage_cache import cache_key as usage_cache_key, usage_cache
+
 # Set page configuration
 st.set_page_config(
     page_title="Client Billing Manager",
@@ -13,6 +39,10 @@ st.set_page_config(
     initial_sidebar_state="collapsed"
 )
 
+# Diagnostics spans the background report build records, in order, for the progress bar
+# (the aggregate comes from the pipeline)
+REPORT_STAGES = ('render', 'save')
+
 # Authentication
 def check_password():
     """Returns `True` if the user had the correct password."""
@@ -59,8 +89,20 @@ def check_password():
     
     return False
 
+def mappings_version():
+    """Version counter of the mapping store, used in cache keys"""
+    return get_mapping_store().version()
+
 def load_account_mappings():
-    """Load account to group mappings"""
+    """Load account to group mappings
+
+    The returned dict is shared across reruns until the mappings change; treat it as read-only.
+    """
+    # Only rebuilt when the mapping store version changes
+    return result_cache.get_or_compute(('app', 'mappings', mappings_version()), read_account_mappings)
+
+def read_account_mappings():
+    """Read account to group mappings from the mapping store"""
     try:
         # Default mappings for common accounts
         default_mappings = {
@@ -71,86 +113,131 @@ def load_account_mappings():
             "8053332897": "INDEPENDENTS"
         }
         
-        # Try to load from file, fallback to defaults
-        try:
-            with open('account_group_mappings.json', 'r') as f:
-                mappings = json.load(f)
-                # Merge with defaults to ensure we have base mappings
-                default_mappings.update(mappings)
-                return default_mappings
-        except (FileNotFoundError, json.JSONDecodeError):
-            return default_mappings
+        # Merge with defaults to ensure we have base mappings
+        default_mappings.update(get_mapping_store().load())
+        return default_mappings
     except Exception:
         return {}
 
 def save_account_mappings(mappings):
     """Save account to group mappings"""
     try:
-        with open('account_group_mappings.json', 'w') as f:
-            json.dump(mappings, f, indent=2)
+        get_mapping_store().replace_all(mappings)
     except Exception as e:
         st.warning(f"Could not save mappings: {e}")
 
-def validate_csv(df):
-    """Validate CSV structure and standardize column names"""
-    if df.empty:
-        st.error("The uploaded file contains no data.")
-        return None
+def assign_accounts(assignments, pipeline=None):
+    """Save many account to group mappings in one batched write
     
-    # Optional column details for troubleshooting
-    if st.checkbox("Show column details", value=False):
-        st.text(f"Found {len(df.columns)} columns: Account, Account Name, Calls Total, Minutes quantity, Messages Total, etc.")
+    With a pipeline, its map and aggregate stages are patched for just these accounts.
+    """
+    try:
+        previous = mappings_version()
+        get_mapping_store().assign_accounts(assignments)
+        if pipeline is not None:
+            patch_pipeline_mappings(pipeline, assignments, previous)
+    except Exception as e:
+        st.warning(f"Could not save mappings: {e}")
+
+def assign_account(account, group, pipeline=None):
+    """Save a single account to group mapping"""
+    try:
+        previous = mappings_version()
+        get_mapping_store().assign_account(account, group)
+        if pipeline is not None:
+            patch_pipeline_mappings(pipeline, {account: group}, previous)
+    except Exception as e:
+        st.warning(f"Could not save mapping: {e}")
+
+def patch_pipeline_mappings(pipeline, assignments, previous_version):
+    """Move the pipeline to the saved mappings incrementally
+    
+    Only when the pipeline was on previous_version and this save was the one
+    write since; otherwise the next run invalidates as usual.
+    """
+    version = mappings_version()
+    if pipeline.version('mappings')[0] == previous_version and version == previous_version + 1:
+        apply_assignments(pipeline, assignments, version, load_account_mappings())
+
+# Enhanced column mappings to handle various naming conventions
+COLUMN_MAPPINGS = {
+    'account': 'Account Number',
+    'account number': 'Account Number',
+    'calls': 'Calls Total',
+    'calls total': 'Calls Total',
+    'minutes': 'Minutes quantity',
+    'minutes quantity': 'Minutes quantity',
+    'messages': 'Messages quantity', 
+    'messages quantity': 'Messages quantity',
+    'messages total': 'Messages Total',
+    'transcriptions': 'Transcriptions quantity',
+    'transcriptions quantity': 'Transcriptions quantity',
+    'askai': 'AskAI quantity',
+    'askai quantity': 'AskAI quantity',
+    'numbers': 'Numbers quantity',
+    'numbers quantity': 'Numbers quantity'
+}
+
+def resolve_column_plan(columns):
+    """Work out how validate_csv renames a header row
     
+    Returns {'columns', 'defaults', 'missing', 'messages'}: the final name of
+    every column in order, required columns that are absent, and the rename
+    notice shown the first time this layout is seen.
+    """
     # Standardize column names - handle the 'Account' vs 'Account Number' issue
-    if 'Account' in df.columns and 'Account Number' not in df.columns:
-        df = df.rename(columns={'Account': 'Account Number'})
-    
-    # Enhanced column mappings to handle various naming conventions
-    column_mappings = {
-        'account': 'Account Number',
-        'account number': 'Account Number',
-        'calls': 'Calls Total',
-        'calls total': 'Calls Total',
-        'minutes': 'Minutes quantity',
-        'minutes quantity': 'Minutes quantity',
-        'messages': 'Messages quantity', 
-        'messages quantity': 'Messages quantity',
-        'messages total': 'Messages Total',
-        'transcriptions': 'Transcriptions quantity',
-        'transcriptions quantity': 'Transcriptions quantity',
-        'askai': 'AskAI quantity',
-        'askai quantity': 'AskAI quantity',
-        'numbers': 'Numbers quantity',
-        'numbers quantity': 'Numbers quantity'
-    }
+    if 'Account' in columns and 'Account Number' not in columns:
+        columns = ['Account Number' if col == 'Account' else col for col in columns]
     
     # Apply case-insensitive column mappings
-    df_columns_lower = {col.lower(): col for col in df.columns}
+    columns_lower = {col.lower(): col for col in columns}
     rename_dict = {}
     
-    for pattern, target in column_mappings.items():
-        if pattern.lower() in df_columns_lower:
-            original_col = df_columns_lower[pattern.lower()]
-            if target not in df.columns:
+    for pattern, target in COLUMN_MAPPINGS.items():
+        if pattern.lower() in columns_lower:
+            original_col = columns_lower[pattern.lower()]
+            if target not in columns:
                 rename_dict[original_col] = target
     
-    if rename_dict:
-        df = df.rename(columns=rename_dict)
-        st.success(f"Renamed columns: {rename_dict}")
+    columns = [rename_dict.get(col, col) for col in columns]
     
     # Ensure required columns exist
     required_columns = ['Account Number']
-    missing_columns = [col for col in required_columns if col not in df.columns]
+    missing_columns = [col for col in required_columns if col not in columns]
+    
+    return {
+        'columns': columns,
+        'defaults': {},
+        'missing': missing_columns,
+        'messages': [f"Renamed columns: {rename_dict}"] if rename_dict else []
+    }
+
+def validate_csv(df, show_messages=True):
+    """Validate CSV structure and standardize column names
+    
+    The column plan is resolved once per header layout and then reused, so
+    repeat uploads in a known export format are only renamed; the rename
+    notice appears the first time a layout is seen.
+    """
+    if df.empty:
+        st.error("The uploaded file contains no data.")
+        return None
+    
+    plan, known_layout = cached_column_plan('app', df.columns, resolve_column_plan)
+    df = apply_column_plan(df, plan)
     
-    if missing_columns:
-        st.error(f"Missing required columns: {missing_columns}")
+    if show_messages and not known_layout:
+        for message in plan['messages']:
+            st.success(message)
+    
+    if plan['missing']:
+        st.error(f"Missing required columns: {plan['missing']}")
         st.info("Available columns: " + ", ".join(df.columns))
         return None
     
     # Convert Account Number to string
     df['Account Number'] = df['Account Number'].astype(str)
     
-    st.success(f"✅ CSV validated successfully - {len(df)} records ready for processing")
     return df
 
 def get_billing_groups():
@@ -163,16 +250,18 @@ def get_billing_groups():
         "INDEPENDENTS"
     ]
 
-def identify_new_accounts(df, mappings):
+def identify_new_accounts(df, mappings, account_index=None):
     """Identify accounts that haven't been assigned to groups"""
-    all_accounts = set(df['Account Number'].astype(str).tolist())
-    mapped_accounts = set(mappings.keys())
-    return list(all_accounts - mapped_accounts)
+    if account_index is None:
+        account_index = build_account_index(df)
+    with span('map', rows=len(account_index)):
+        return [account for account in account_index if account not in mappings]
 
-def create_consolidated_billing_excel(df, mappings):
-    """Create comprehensive Excel file with billing data"""
-    output = io.BytesIO()
-    workbook = xlsxwriter.Workbook(output, {'in_memory': True})
+def write_consolidated_billing_workbook(workbook, df, mappings, account_index=None, aggregate=None):
+    """Write comprehensive Excel sheet with billing data
+    
+    An aggregate already computed by aggregate_billing is written as is.
+    """
     worksheet = workbook.add_worksheet('Consolidated Billing')
     
     # Define formats
@@ -196,183 +285,180 @@ def create_consolidated_billing_excel(df, mappings):
         'align': 'left'
     })
     
-    # Write main header
-    current_month = datetime.now().strftime('%B %Y')
-    worksheet.write(0, 0, f'Consolidated Client Billing Report - {current_month}', header_format)
-    worksheet.merge_range(0, 0, 0, 7, f'Consolidated Client Billing Report - {current_month}', header_format)
-    
-    # Calculate global totals
-    processed_accounts = []
-    global_calls = df['Calls Total'].fillna(0).astype(float).sum()
-    global_minutes = df['Minutes quantity'].fillna(0).astype(float).sum()
-    
-    # Use Messages Total if available, otherwise Messages quantity
-    if 'Messages Total' in df.columns:
-        global_messages = df['Messages Total'].fillna(0).astype(float).sum()
-    else:
-        global_messages = df['Messages quantity'].fillna(0).astype(float).sum()
+    # Aggregate per account, per group and globally in one pass
+    if aggregate is None:
+        with span('aggregate', rows=len(df)):
+            aggregate = aggregate_billing(df, mappings, account_index)
     
-    # Calculate transcription minutes from cost divided by $0.02
-    if 'Transcriptions cost' in df.columns:
-        # Remove $ sign and convert to float, then divide by 0.02 to get minutes
-        transcription_costs = df['Transcriptions cost'].fillna('$0.00').astype(str).str.replace('$', '').str.replace(',', '').astype(float)
-        global_transcription = (transcription_costs / 0.02).sum()
+    # Write report
+    current_month = datetime.now().strftime('%B %Y')
+    with span('render', rows=len(aggregate['accounts'])):
+        write_consolidated_sheet(
+            worksheet,
+            aggregate,
+            f'Consolidated Client Billing Report - {current_month}',
+            header_format,
+            group_format,
+            account_format
+        )
+    
+    return aggregate['processed_accounts']
+
+def create_consolidated_billing_excel(df, mappings, account_index=None):
+    """Create the consolidated billing workbook in memory and return its bytes"""
+    output = io.BytesIO()
+    workbook = xlsxwriter.Workbook(output, {'in_memory': True})
+    processed_accounts = write_consolidated_billing_workbook(workbook, df, mappings, account_index)
+    with span('save'):
+        workbook.close()
+    output.seek(0)
+    return output.getvalue(), processed_accounts
+
+def create_consolidated_billing_file(df, mappings, account_index=None, aggregate=None):
+    """Create the consolidated billing workbook on disk in constant-memory mode
+
+    Rows are flushed to a temp file as they are written, so memory stays flat
+    regardless of report size. Returns (ReportFile, processed_accounts).
+    """
+    report = ReportFile()
+    workbook = xlsxwriter.Workbook(report.path, {'constant_memory': True})
+    processed_accounts = write_consolidated_billing_workbook(workbook, df, mappings, account_index, aggregate)
+    with span('save'):
+        workbook.close()
+    return report, processed_accounts
+
+def ingest_upload(source):
+    """Read an upload's rows (pipeline ingest stage)
+    
+    source is the pipeline's source dict with name, stream and either
+    file (the UploadedFile, read in place rather than copied) or path (the
+    test data file). Only columns the validator recognizes are parsed; in large file
+    mode CSVs are streamed into an already validated and normalized account
+    summary, or None if validation fails.
+    """
+    if source.get('file') is not None:
+        upload = source['file']
+        upload.seek(0)
     else:
-        # Fallback to quantity if cost column not available
-        global_transcription = df['Transcriptions quantity'].fillna(0).astype(float).sum()
-    
-    global_askai = df['AskAI quantity'].fillna(0).astype(float).sum()
-    global_numbers = df['Numbers quantity'].fillna(0).astype(float).sum()
-    
-    # Apply BBT multiplier to global AskAI total
-    bbt_accounts = [acc for acc, group in mappings.items() if group == "BIG BRAND TIRE GROUP" and acc in df['Account Number'].astype(str).values]
-    bbt_askai_adjustment = 0
-    for account in bbt_accounts:
-        account_row = df[df['Account Number'].astype(str) == account]
-        if not account_row.empty:
-            bbt_askai_adjustment += account_row['AskAI quantity'].fillna(0).astype(float).iloc[0] * 6  # 7x - 1x = 6x additional
-    
-    global_askai_with_multiplier = global_askai + bbt_askai_adjustment
-    
-    # Write global summary in line 2
-    worksheet.write(1, 0, 'GLOBAL TOTALS', group_format)
-    worksheet.write(1, 1, f'{len(df)} accounts', group_format)
-    worksheet.write(1, 2, int(global_calls), group_format)
-    worksheet.write(1, 3, int(global_minutes), group_format)
-    worksheet.write(1, 4, int(global_messages), group_format)
-    worksheet.write(1, 5, int(global_transcription), group_format)
-    worksheet.write(1, 6, int(global_askai_with_multiplier), group_format)
-    worksheet.write(1, 7, int(global_numbers), group_format)
-    
-    # Column headers
-    headers = ['Account', 'Account Name', 'Calls Total', 'Minutes quantity', 'Messages quantity', 'Transcription Minutes', 'AskAI quantity', 'Numbers quantity']
-    for col, header in enumerate(headers):
-        worksheet.write(2, col, header, header_format)
-    
-    # Group accounts by billing group
-    grouped_data = {}
-    for account, group in mappings.items():
-        if account in df['Account Number'].astype(str).values:
-            if group not in grouped_data:
-                grouped_data[group] = []
-            
-            account_row = df[df['Account Number'].astype(str) == account].iloc[0]
-            grouped_data[group].append(account_row)
-            processed_accounts.append(account)
-    
-    row = 3
-    
-    # Process each group in specific order
-    for group_name in ["BTTW GROUP", "BIG BRAND TIRE GROUP", "Sylvan Learning", "Truckfitters", "INDEPENDENTS"]:
-        if group_name not in grouped_data:
-            continue
+        with open(source['path'], 'rb') as f:
+            upload = io.BytesIO(f.read())
+    
+    # Read file based on extension with improved error handling
+    streamed = source['name'].endswith('.csv') and source['stream']
+    with span('read_stream' if streamed else 'read') as record:
+        if streamed:
+            # Stream in chunks, keeping one row per account plus running totals
+            try:
+                df = stream_usage_csv(upload, validate_csv, column_mappings=COLUMN_MAPPINGS, encoding='utf-8')
+            except UnicodeDecodeError:
+                upload.seek(0)
+                df = stream_usage_csv(upload, validate_csv, column_mappings=COLUMN_MAPPINGS, encoding='latin-1')
+            except pd.errors.EmptyDataError:
+                st.error("The CSV file appears to be empty or has no columns to parse.")
+                st.stop()
+        elif source['name'].endswith('.csv'):
+            try:
+                df = read_usage_csv(upload, COLUMN_MAPPINGS, encoding='utf-8')
+            except UnicodeDecodeError:
+                upload.seek(0)
+                df = read_usage_csv(upload, COLUMN_MAPPINGS, encoding='latin-1')
+            except pd.errors.EmptyDataError:
+                st.error("The CSV file appears to be empty or has no columns to parse.")
+                st.stop()
+        else:
+            # Stream the sheet, keeping only columns the validator recognizes
+            df = read_usage_xlsx(upload, ingest_columns(COLUMN_MAPPINGS))
+        if df is not None:
+            record['rows'] = input_totals(df)['records'] if is_normalized(df) else len(df)
+    return df
+
+def normalize_upload(pipeline):
+    """Validate, normalize, consolidate and compact the ingested rows (pipeline normalize stage)
+    
+    Uploads parsed before are loaded from the Parquet usage cache without
+    running ingest. Otherwise the ingest result is released once the
+    compact frame is built. Returns (df, account_index), or None if
+    validation fails.
+    """
+    data_version, _, stream_large_file = pipeline.version('source')[0]
+    cache_key = usage_cache_key('app', data_version, summary=stream_large_file)
+    with span('read_cache') as record:
+        df = usage_cache.load(cache_key)
+        record['rows'] = None if df is None else len(df)
+    
+    if df is None:
+        df = pipeline.get('ingest')
+        pipeline.release('ingest')
+        if df is not None and not is_normalized(df):
+            # Check if dataframe is empty
+            if df.empty:
+                st.error("The uploaded file contains no data. Please check your file and try again.")
+                st.stop()
             
-        accounts = grouped_data[group_name]
-        
-        # Calculate group totals
-        group_calls = sum(pd.to_numeric(acc.get('Calls Total', 0), errors='coerce') or 0 for acc in accounts)
-        group_minutes = sum(pd.to_numeric(acc.get('Minutes quantity', 0), errors='coerce') or 0 for acc in accounts)  
-        
-        # Use Messages Total if available, otherwise Messages quantity
-        group_messages = 0
-        for acc in accounts:
-            if 'Messages Total' in acc and acc.get('Messages Total') is not None:
-                group_messages += pd.to_numeric(acc.get('Messages Total', 0), errors='coerce') or 0
-            else:
-                group_messages += pd.to_numeric(acc.get('Messages quantity', 0), errors='coerce') or 0
-        
-        # Calculate transcription minutes from cost
-        group_transcription = 0
-        for acc in accounts:
-            if 'Transcriptions cost' in acc and acc.get('Transcriptions cost'):
-                cost_str = str(acc.get('Transcriptions cost', '$0.00')).replace('$', '').replace(',', '')
-                try:
-                    cost = float(cost_str)
-                    group_transcription += cost / 0.02
-                except (ValueError, TypeError):
-                    group_transcription += pd.to_numeric(acc.get('Transcriptions quantity', 0), errors='coerce') or 0
-            else:
-                group_transcription += pd.to_numeric(acc.get('Transcriptions quantity', 0), errors='coerce') or 0
-        
-        group_askai = sum(pd.to_numeric(acc.get('AskAI quantity', 0), errors='coerce') or 0 for acc in accounts)
-        group_numbers = sum(pd.to_numeric(acc.get('Numbers quantity', 0), errors='coerce') or 0 for acc in accounts)
-        
-        # Apply BBT multiplier rule
-        if group_name == "BIG BRAND TIRE GROUP":
-            group_askai *= 7
-        
-        # Write group summary row
-        worksheet.write(row, 0, group_name, group_format)
-        worksheet.write(row, 1, f'{len(accounts)} accounts', group_format)
-        worksheet.write(row, 2, int(group_calls), group_format)
-        worksheet.write(row, 3, int(group_minutes), group_format)
-        worksheet.write(row, 4, int(group_messages), group_format)
-        worksheet.write(row, 5, int(group_transcription), group_format)
-        worksheet.write(row, 6, int(group_askai), group_format)
-        worksheet.write(row, 7, int(group_numbers), group_format)
-        row += 1
-        
-        # Sort accounts alphabetically by account name
-        accounts_sorted = sorted(accounts, key=lambda x: x.get('Account Name', 'Unknown').upper())
+            # Validate and process
+            with span('validate', rows=len(df)):
+                df = validate_csv(df)
+            if df is not None:
+                # Convert metric columns to typed numbers once for all downstream steps
+                with span('normalize', rows=len(df)):
+                    df = normalize_metrics(df)
+                # One row per account, summing accounts listed on several rows
+                with span('consolidate', rows=len(df)):
+                    df = consolidate_accounts(df)
         
-        # Write individual account rows
-        for account in accounts_sorted:
-            account_number = str(account['Account Number'])
-            account_name = account.get('Account Name', 'Unknown')
-            calls_total = pd.to_numeric(account.get('Calls Total', 0), errors='coerce') or 0
-            minutes_quantity = pd.to_numeric(account.get('Minutes quantity', 0), errors='coerce') or 0
-            
-            # Use Messages Total if available, otherwise Messages quantity
-            if 'Messages Total' in account and account.get('Messages Total') is not None:
-                messages_quantity = pd.to_numeric(account.get('Messages Total', 0), errors='coerce') or 0
-            else:
-                messages_quantity = pd.to_numeric(account.get('Messages quantity', 0), errors='coerce') or 0
-            
-            # Calculate transcription minutes from cost
-            if 'Transcriptions cost' in account and account.get('Transcriptions cost'):
-                cost_str = str(account.get('Transcriptions cost', '$0.00')).replace('$', '').replace(',', '')
-                try:
-                    cost = float(cost_str)
-                    transcription_minutes = cost / 0.02
-                except (ValueError, TypeError):
-                    transcription_minutes = pd.to_numeric(account.get('Transcriptions quantity', 0), errors='coerce') or 0
-            else:
-                transcription_minutes = pd.to_numeric(account.get('Transcriptions quantity', 0), errors='coerce') or 0
-            
-            askai_quantity = pd.to_numeric(account.get('AskAI quantity', 0), errors='coerce') or 0
-            numbers_quantity = pd.to_numeric(account.get('Numbers quantity', 0), errors='coerce') or 0
-            
-            # Individual accounts show original values (no multiplier applied)
-            worksheet.write(row, 0, account_number, account_format)
-            worksheet.write(row, 1, account_name, account_format)
-            worksheet.write(row, 2, int(calls_total) if calls_total > 0 else '', account_format)
-            worksheet.write(row, 3, int(minutes_quantity) if minutes_quantity > 0 else '', account_format)
-            worksheet.write(row, 4, int(messages_quantity) if messages_quantity > 0 else '', account_format)
-            worksheet.write(row, 5, int(transcription_minutes) if transcription_minutes > 0 else '', account_format)
-            worksheet.write(row, 6, int(askai_quantity) if askai_quantity > 0 else '', account_format)
-            worksheet.write(row, 7, int(numbers_quantity) if numbers_quantity > 0 else '', account_format)
-            row += 1
+        if df is None:
+            return None
         
-        # Add blank row between groups
-        row += 1
-    
-    # Auto-adjust column widths
-    worksheet.set_column(0, 0, 15)  # Account
-    worksheet.set_column(1, 1, 25)  # Account Name
-    worksheet.set_column(2, 7, 15)  # All quantity columns
-    
-    # Freeze the header row
-    worksheet.freeze_panes(3, 0)
-    
-    workbook.close()
-    output.seek(0)
-    return output.getvalue(), processed_accounts
+        # Smallest lossless dtypes before the frame is cached and kept in the session
+        with span('compact', rows=len(df)):
+            df = compact_usage_frame(df)
+        with span('cache_store', rows=len(df)):
+            usage_cache.store(cache_key, df)
+    
+    with span('index', rows=len(df)):
+        return df, build_account_index(df)
 
-def main():
-    # Check password first
-    if not check_password():
-        return
-    
+def map_accounts(pipeline):
+    """Accounts without a billing group (pipeline map stage)"""
+    df, account_index = pipeline.get('normalize')
+    return result_cache.get_or_compute(
+        ('app', 'new_accounts') + pipeline.version('source', 'mappings'),
+        lambda: identify_new_accounts(df, pipeline.input('mappings'), account_index)
+    )
+
+def aggregate_usage(pipeline):
+    """Account, group and global totals for the current mappings (pipeline aggregate stage)"""
+    df, account_index = pipeline.get('normalize')
+    with span('aggregate', rows=len(df)):
+        return aggregate_billing(df, pipeline.input('mappings'), account_index)
+
+def render_report(pipeline):
+    """Start (or reuse) the background build of the consolidated workbook (pipeline render stage)
+    
+    Returns the ReportJob; its result is (ReportFile, processed_accounts).
+    """
+    df, account_index = pipeline.get('normalize')
+    return report_jobs.submit(
+        ('app', 'workbook') + pipeline.version('source', 'mappings', 'rules', 'report'),
+        partial(create_consolidated_billing_file, df, pipeline.input('mappings'), account_index, pipeline.get('aggregate')),
+        stages=REPORT_STAGES
+    )
+
+def create_pipeline():
+    """Billing pipeline for one session, sharing parses and new-account lists across sessions"""
+    return BillingPipeline({
+        'ingest': lambda pipeline: ingest_upload(pipeline.input('source')),
+        'normalize': lambda pipeline: result_cache.get_or_compute(
+            ('app', 'parse') + pipeline.version('source', 'rules'),
+            partial(normalize_upload, pipeline)
+        ),
+        'map': map_accounts,
+        'aggregate': aggregate_usage,
+        'render': render_report
+    })
+
+def render_billing_page(diagnostics):
+    """Upload, account mapping and report sections of the Client Billing Manager"""
     st.title("📊 Client Billing Manager")
     st.markdown("**Secure Password-Protected Billing System**")
     st.markdown("---")
@@ -386,7 +472,21 @@ def main():
         help="Upload your monthly tracking number usage file"
     )
     
+    stream_large_file = st.checkbox(
+        "Large file mode",
+        value=False,
+        help="Stream CSV uploads in chunks and keep only per-account totals in memory"
+    )
+    
+    # One lazily computed pipeline per session; stages are recomputed only when their inputs change
+    if 'pipeline' not in st.session_state:
+        st.session_state['pipeline'] = create_pipeline()
+    pipeline = st.session_state['pipeline']
+    pipeline.set_input('rules', billing_rules_version())
+    pipeline.set_input('mappings', mappings_version(), load_account_mappings())
+    
     # Process uploaded file
+    parsed = None
     if uploaded_file:
         try:
             # Check if file is empty
@@ -394,32 +494,27 @@ def main():
                 st.error("The uploaded file is empty. Please upload a valid CSV or Excel file.")
                 st.stop()
             
-            # Reset file pointer
-            uploaded_file.seek(0)
-            
-            # Read file based on extension with improved error handling
-            if uploaded_file.name.endswith('.csv'):
-                try:
-                    df = pd.read_csv(uploaded_file, encoding='utf-8')
-                except UnicodeDecodeError:
-                    uploaded_file.seek(0)
-                    df = pd.read_csv(uploaded_file, encoding='latin-1')
-                except pd.errors.EmptyDataError:
-                    st.error("The CSV file appears to be empty or has no columns to parse.")
-                    st.stop()
-            else:
-                df = pd.read_excel(uploaded_file)
-            
-            # Check if dataframe is empty
-            if df.empty:
-                st.error("The uploaded file contains no data. Please check your file and try again.")
-                st.stop()
+            # A new upload invalidates every pipeline stage; reruns reuse them.
+            # The pipeline reads the UploadedFile itself, so no second copy of the bytes is kept.
+            pipeline.set_input(
+                'source',
+                (upload_hash(uploaded_file), uploaded_file.name, stream_large_file),
+                {'name': uploaded_file.name, 'file': uploaded_file, 'stream': stream_large_file}
+            )
+            parsed = pipeline.get('normalize')
             
-            # Validate and process
-            df = validate_csv(df)
-            if df is not None:
-                st.session_state['billing_data'] = df
-                st.success(f"✅ File uploaded successfully: {len(df)} records processed")
+            if parsed is not None:
+                df = parsed[0]
+                # Shown on every run: validation itself only runs when the upload is first parsed
+                if st.checkbox("Show column details", value=False):
+                    st.text(f"Found {len(df.columns)} columns: {', '.join(map(str, df.columns))}")
+                st.success(f"✅ CSV validated successfully - {input_totals(df)['records']} records ready for processing")
+                st.success(f"✅ File uploaded successfully: {input_totals(df)['records']} records processed")
+                if 'memory_bytes' in df.attrs:
+                    before, after = df.attrs['memory_bytes']
+                    st.caption(f"In-memory size: {before / 1048576:,.1f} MB → {after / 1048576:,.1f} MB with compact types")
+                if df.attrs.get('merged_rows'):
+                    st.info(f"Merged {df.attrs['merged_rows']:,} duplicate account rows; each account's metrics are summed into one row")
             else:
                 st.error("File validation failed. Please check the file format.")
                 
@@ -428,12 +523,17 @@ def main():
         except Exception as e:
             st.error(f"Error processing file: {str(e)}")
             st.error("Please ensure your file is a valid CSV or Excel file.")
+    elif pipeline.has_input('source'):
+        try:
+            parsed = pipeline.get('normalize')
+        except Exception as e:
+            st.error(f"Error processing file: {str(e)}")
     
     # Main processing
-    if 'billing_data' in st.session_state:
-        df = st.session_state['billing_data']
-        mappings = load_account_mappings()
-        new_accounts = identify_new_accounts(df, mappings)
+    if parsed is not None:
+        df, account_index = parsed
+        mappings = pipeline.input('mappings')
+        new_accounts = pipeline.get('map')
         
         # Account assignment
         st.header("2. Account Assignment")
@@ -443,36 +543,47 @@ def main():
             
             groups = get_billing_groups()
             
-            # Show assignment interface for first 5 accounts
-            for i, account in enumerate(new_accounts[:5]):
-                account_row = df[df['Account Number'].astype(str) == account]
-                if not account_row.empty and 'Account Name' in df.columns:
-                    account_display = f"{account} - {account_row['Account Name'].iloc[0]}"
-                else:
-                    account_display = account
-                
-                col1, col2, col3 = st.columns([3, 2, 1])
-                
-                with col1:
-                    st.write(f"**{account_display}**")
-                
-                with col2:
-                    selected_group = st.selectbox(
-                        "Assign to group:",
-                        ["Select group..."] + groups,
-                        key=f"assign_{account}_{i}"
-                    )
-                
-                with col3:
-                    if st.button("Assign", key=f"btn_{account}_{i}"):
-                        if selected_group != "Select group...":
-                            mappings[account] = selected_group
-                            save_account_mappings(mappings)
-                            st.success(f"Assigned to {selected_group}")
-                            st.rerun()
+            bulk_mode = st.checkbox(
+                "Bulk assignment mode",
+                value=False,
+                help="Assign all unmapped accounts from one table and save them in a single write"
+            )
             
-            if len(new_accounts) > 5:
-                st.info(f"Showing first 5 accounts. {len(new_accounts) - 5} more need assignment.")
+            if bulk_mode:
+                assignments = render_bulk_assignment(df, new_accounts, account_index, groups)
+                if assignments:
+                    assign_accounts(assignments, pipeline)
+                    st.success(f"Assigned {len(assignments)} accounts")
+                    st.rerun()
+            else:
+                # Show assignment interface for first 5 accounts
+                for i, account in enumerate(new_accounts[:5]):
+                    if 'Account Name' in df.columns:
+                        account_display = f"{account} - {df['Account Name'].iat[account_index[account]]}"
+                    else:
+                        account_display = account
+                    
+                    col1, col2, col3 = st.columns([3, 2, 1])
+                    
+                    with col1:
+                        st.write(f"**{account_display}**")
+                    
+                    with col2:
+                        selected_group = st.selectbox(
+                            "Assign to group:",
+                            ["Select group..."] + groups,
+                            key=f"assign_{account}_{i}"
+                        )
+                    
+                    with col3:
+                        if st.button("Assign", key=f"btn_{account}_{i}"):
+                            if selected_group != "Select group...":
+                                assign_account(account, selected_group, pipeline)
+                                st.success(f"Assigned to {selected_group}")
+                                st.rerun()
+                
+                if len(new_accounts) > 5:
+                    st.info(f"Showing first 5 accounts. {len(new_accounts) - 5} more need assignment.")
         else:
             st.success("✅ All accounts assigned to billing groups")
         
@@ -482,35 +593,51 @@ def main():
         if new_accounts:
             st.info("Complete account assignment to enable download")
         else:
-            excel_data, processed_accounts = create_consolidated_billing_excel(df, mappings)
-            st.download_button(
-                label="📥 Download Consolidated Billing Report",
-                data=excel_data,
-                file_name=f"consolidated_billing_{datetime.now().strftime('%Y-%m-%d')}.xlsx",
-                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-            )
+            # The workbook is built in the background and rebuilt only when the
+            # data, mappings or report month change
+            pipeline.set_input('report', datetime.now().strftime('%B %Y'))
+            report_job = pipeline.get('render')
+            
+            if not report_job.done():
+                render_report_progress(report_job)
+            elif report_job.error() is not None:
+                st.error(f"Error building report: {report_job.error()}")
+                if st.button("🔁 Retry report"):
+                    report_jobs.discard(report_job.key)
+                    pipeline.invalidate('render')
+                    st.rerun()
+            else:
+                report_file, processed_accounts = report_job.result()
+                # The workbook is read from disk only when the button is clicked
+                st.download_button(
+                    label="📥 Download Consolidated Billing Report",
+                    data=report_file.read_bytes,
+                    file_name=f"consolidated_billing_{datetime.now().strftime('%Y-%m-%d')}.xlsx",
+                    mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+                )
         
         # Data preview
         st.header("4. Data Preview")
         
-        # Group summary
-        grouped_data = {}
-        for account, group in mappings.items():
-            if account in df['Account Number'].astype(str).values:
-                if group not in grouped_data:
-                    grouped_data[group] = 0
-                grouped_data[group] += 1
+        # Group summary from the memoized aggregate
+        group_counts = pipeline.get('aggregate')['groups']['accounts']
         
-        if grouped_data:
+        if len(group_counts):
             st.write("**Account Groups:**")
-            for group_name, count in grouped_data.items():
+            for group_name, count in group_counts.items():
                 st.write(f"• {group_name}: {count} accounts")
         
+        st.download_button(
+            label="📤 Export Account Mappings (JSON)",
+            data=get_mapping_store().export_json(),
+            file_name="account_group_mappings.json",
+            mime="application/json"
+        )
+        
         # Reset section
         st.header("5. Reset")
         if st.button("🔄 Clear Data"):
-            if 'billing_data' in st.session_state:
-                del st.session_state['billing_data']
+            pipeline.clear()
             st.success("Data cleared")
             st.rerun()
     
@@ -530,6 +657,22 @@ def main():
         - **AskAI quantity**
         - **Numbers quantity**
         """)
+    
+    # Pipeline diagnostics
+    render_diagnostics(diagnostics)
+
+def main():
+    # Check password first
+    if not check_password():
+        return
+    
+    # Record per-stage timings for the Diagnostics section; the recorder is
+    # stopped even when st.stop() ends the run early
+    diagnostics = start_recording(st.session_state.get('diagnostics_trace_memory', False))
+    try:
+        render_billing_page(diagnostics)
+    finally:
+        stop_recording()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,253 @@
+"""
+Pipeline Benchmark
+Synthetic tracking_number_usage generator and per-stage timing and memory
+profile of the standalone tool's pipeline
+
+    python benchmark.py                                  # 1k, 100k and 1M accounts
+    python benchmark.py --sizes 1000,100000 --output bench_results.json
+    python benchmark.py --compare bench_results_old.json
+
+Each stage is run once untraced for wall time (best of --repeat) and once
+under tracemalloc for peak memory, so tracing overhead never shows up in
+the timings. Generated files are kept in --data-dir and reused.
+"""
+
+import argparse
+import gc
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from billing_engine import build_account_index, consolidate_accounts, normalize_metrics, read_usage_csv
+from client_sort_standalone import (
+    COLUMN_MAPPINGS,
+    create_consolidated_billing_excel,
+    identify_new_accounts,
+    validate_csv,
+    validate_data_integrity
+)
+
+DEFAULT_SIZES = [1000, 100000, 1000000]
+
+# Share of accounts per billing group in generated mappings (roughly the live mix)
+GROUP_WEIGHTS = {
+    "BTTW GROUP": 0.45,
+    "BIG BRAND TIRE GROUP": 0.20,
+    "Sylvan Learning": 0.10,
+    "Truckfitters": 0.05,
+    "INDEPENDENTS": 0.20
+}
+
+NAME_WORDS = ['Tire', 'Auto', 'Learning', 'Fleet', 'Service', 'Center', 'Truck', 'Supply', 'Group', 'Pros']
+
+def generate_usage_frame(accounts, seed=0):
+    """Synthetic usage export with the columns from the Expected File Format help
+
+    Account numbers are unique 7-digit strings; Transcriptions cost is
+    '$1,234.56' formatted, with a few blanks so the quantity fallback is used.
+    """
+    rng = np.random.default_rng(seed)
+    account_numbers = rng.choice(np.arange(1000000, 10000000), size=accounts, replace=False)
+    words = np.array(NAME_WORDS)
+    names = pd.Series(words[rng.integers(0, len(words), accounts)]) + ' ' + pd.Series(words[rng.integers(0, len(words), accounts)])
+
+    calls = rng.negative_binomial(2, 0.02, accounts)
+    minutes = (calls * rng.gamma(2.0, 1.5, accounts)).round()
+    messages = rng.negative_binomial(1, 0.03, accounts)
+    transcriptions = (minutes * rng.uniform(0, 0.8, accounts)).round()
+    costs = pd.Series(transcriptions * 0.02).map('${:,.2f}'.format)
+    costs[rng.random(accounts) < 0.02] = ''
+
+    return pd.DataFrame({
+        'Account': account_numbers.astype(str),
+        'Account Name': names + ' ' + pd.Series(account_numbers % 1000).astype(str),
+        'Calls Total': calls,
+        'Minutes quantity': minutes.astype(int),
+        'Messages Total': messages,
+        'Messages quantity': messages,
+        'Transcriptions quantity': transcriptions.astype(int),
+        'Transcriptions cost': costs,
+        'AskAI quantity': rng.poisson(3, accounts) * (rng.random(accounts) < 0.3),
+        'Numbers quantity': rng.integers(1, 6, accounts)
+    })
+
+def generate_mappings(usage, unmapped_fraction=0.01, seed=0):
+    """Account to group mappings for all but unmapped_fraction of the accounts"""
+    rng = np.random.default_rng(seed + 1)
+    accounts = usage['Account'][rng.random(len(usage)) >= unmapped_fraction]
+    groups = rng.choice(list(GROUP_WEIGHTS), size=len(accounts), p=list(GROUP_WEIGHTS.values()))
+    return dict(zip(accounts, groups.tolist()))
+
+def ensure_dataset(accounts, data_dir):
+    """Write (or reuse) the usage CSV and mappings JSON for a size; returns their paths"""
+    os.makedirs(data_dir, exist_ok=True)
+    usage_path = os.path.join(data_dir, f'tracking_number_usage_{accounts}.csv')
+    mappings_path = os.path.join(data_dir, f'account_group_mappings_{accounts}.json')
+    if not (os.path.exists(usage_path) and os.path.exists(mappings_path)):
+        usage = generate_usage_frame(accounts)
+        usage.to_csv(usage_path, index=False)
+        with open(mappings_path, 'w') as f:
+            json.dump(generate_mappings(usage), f)
+    return usage_path, mappings_path
+
+def pipeline_stages(usage_path, mappings):
+    """(name, function) pairs; each function updates the shared state dict and returns rows processed"""
+    def read(state):
+        state['df'] = read_usage_csv(usage_path, COLUMN_MAPPINGS)
+        return len(state['df'])
+
+    def validate(state):
+        state['df'] = validate_csv(state['df'], show_messages=False)
+        return len(state['df'])
+
+    def normalize(state):
+        state['df'] = normalize_metrics(state['df'])
+        return len(state['df'])
+
+    def consolidate(state):
+        state['df'] = consolidate_accounts(state['df'])
+        state['account_index'] = build_account_index(state['df'])
+        return len(state['df'])
+
+    def new_accounts(state):
+        state['new_accounts'] = identify_new_accounts(state['df'], mappings, state['account_index'])
+        return len(state['account_index'])
+
+    def excel(state):
+        state['excel'], state['processed_accounts'] = create_consolidated_billing_excel(
+            state['df'], mappings, state['account_index']
+        )
+        return len(state['processed_accounts'])
+
+    def integrity(state):
+        state['validation'] = validate_data_integrity(
+            state['df'], mappings, state['processed_accounts'], state['account_index']
+        )
+        return len(state['processed_accounts'])
+
+    return [
+        ('read', read),
+        ('validate_csv', validate),
+        ('normalize', normalize),
+        ('consolidate_accounts', consolidate),
+        ('identify_new_accounts', new_accounts),
+        ('create_consolidated_billing_excel', excel),
+        ('validate_data_integrity', integrity)
+    ]
+
+def run_pipeline(stages, traced):
+    """Run every stage once; returns {stage: (seconds, rows, peak_bytes or None)}"""
+    state = {}
+    results = {}
+    for name, stage in stages:
+        gc.collect()
+        if traced:
+            tracemalloc.start()
+            baseline = tracemalloc.get_traced_memory()[0]
+        started = time.perf_counter()
+        rows = stage(state)
+        elapsed = time.perf_counter() - started
+        peak = None
+        if traced:
+            peak = tracemalloc.get_traced_memory()[1] - baseline
+            tracemalloc.stop()
+        results[name] = (elapsed, rows, peak)
+    return results
+
+def benchmark_size(accounts, data_dir, repeat=1, profile_memory=True):
+    """Benchmark every stage for one dataset size; returns a list of result rows"""
+    usage_path, mappings_path = ensure_dataset(accounts, data_dir)
+    with open(mappings_path, 'r') as f:
+        mappings = json.load(f)
+    stages = pipeline_stages(usage_path, mappings)
+
+    timings = [run_pipeline(stages, traced=False) for _ in range(repeat)]
+    memory = run_pipeline(stages, traced=True) if profile_memory else {}
+
+    rows = []
+    for name, _ in stages:
+        peak = memory[name][2] if name in memory else None
+        rows.append({
+            'accounts': accounts,
+            'stage': name,
+            'seconds': round(min(run[name][0] for run in timings), 4),
+            'rows': timings[0][name][1],
+            'peak_mb': None if peak is None else round(peak / (1024 * 1024), 2)
+        })
+    return rows
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare_results(current, previous):
+    """Per stage and size ratio of current to previous seconds and peak memory"""
+    before = {(row['accounts'], row['stage']): row for row in previous['results']}
+    comparison = []
+    for row in current['results']:
+        old = before.get((row['accounts'], row['stage']))
+        if old is None:
+            continue
+        comparison.append({
+            'accounts': row['accounts'],
+            'stage': row['stage'],
+            'seconds_ratio': round(row['seconds'] / old['seconds'], 2) if old['seconds'] else None,
+            'peak_mb_ratio': round(row['peak_mb'] / old['peak_mb'], 2) if row['peak_mb'] and old['peak_mb'] else None
+        })
+    return comparison
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the billing pipeline on synthetic usage files")
+    parser.add_argument('--sizes', default=','.join(map(str, DEFAULT_SIZES)), help="comma-separated account counts")
+    parser.add_argument('--data-dir', default='bench_data', help="directory for generated usage and mapping files")
+    parser.add_argument('--output', default='bench_results.json', help="JSON results file")
+    parser.add_argument('--repeat', type=int, default=1, help="timing runs per size (best is kept)")
+    parser.add_argument('--no-memory', action='store_true', help="skip the tracemalloc pass")
+    parser.add_argument('--compare', help="earlier results file to compare against")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    sizes = [int(size) for size in args.sizes.split(',')]
+
+    results = []
+    for accounts in sizes:
+        rows = benchmark_size(accounts, args.data_dir, args.repeat, not args.no_memory)
+        for row in rows:
+            peak = '' if row['peak_mb'] is None else f"{row['peak_mb']:>10.1f} MB"
+            print(f"{accounts:>9} {row['stage']:<36} {row['seconds']:>9.3f} s {peak}")
+        results.extend(rows)
+
+    report = {
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'results': results
+    }
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            report['comparison'] = compare_results(report, json.load(f))
+        for row in report['comparison']:
+            print(f"{row['accounts']:>9} {row['stage']:<36} time x{row['seconds_ratio']}  memory x{row['peak_mb_ratio']}")
+
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {args.output}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,195 @@
+"""
+Client Billing CLI
+Headless batch runner for tracking_number_usage files
+
+Runs the standalone tool's ingest, validate, map, aggregate and Excel steps
+for every input file across a process pool. Each input produces
+<name>_billing.xlsx and <name>_integrity.json in the output directory.
+
+    python billing_cli.py exports/ --output-dir reports/
+    python billing_cli.py "history/2025-*.csv" --month "June 2025" --workers 4
+"""
+
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import pandas as pd
+
+from billing_engine import (
+    build_account_index,
+    compact_usage_frame,
+    consolidate_accounts,
+    file_hash,
+    ingest_columns,
+    normalize_metrics,
+    read_usage_csv,
+    read_usage_xlsx,
+    REPORT_INPUT_COLUMNS,
+    stream_usage_csv
+)
+from client_sort_standalone import (
+    COLUMN_MAPPINGS,
+    create_consolidated_billing_file,
+    validate_csv,
+    validate_data_integrity
+)
+from mapping_store import MAPPINGS_DB, MAPPINGS_JSON, get_mapping_store
+from usage_cache import cache_key as usage_cache_key, usage_cache
+
+USAGE_FILE_EXTENSIONS = ('.csv', '.xlsx', '.xls')
+
+# Mappings are loaded once in the parent and handed to each worker at start-up
+_worker_mappings = {}
+
+def find_usage_files(inputs):
+    """Expand directories and glob patterns into a sorted list of usage files"""
+    paths = set()
+    for pattern in inputs:
+        if os.path.isdir(pattern):
+            candidates = [os.path.join(pattern, name) for name in os.listdir(pattern)]
+        else:
+            candidates = glob.glob(pattern, recursive=True)
+        paths.update(
+            path for path in candidates
+            if os.path.isfile(path) and path.lower().endswith(USAGE_FILE_EXTENSIONS)
+        )
+    return sorted(paths)
+
+def read_usage_file(path, chunksize=None):
+    """Read, validate, normalize and consolidate a usage file; returns None if validation fails
+
+    Files the standalone app or an earlier run already parsed are loaded from
+    the Parquet usage cache, reading only the columns the report needs.
+    """
+    key = usage_cache_key('standalone', file_hash(path), summary=bool(chunksize))
+    df = usage_cache.load(key, columns=REPORT_INPUT_COLUMNS)
+    if df is not None:
+        return df
+
+    if path.lower().endswith('.csv') and chunksize:
+        df = stream_usage_csv(path, validate_csv, chunksize=chunksize, column_mappings=COLUMN_MAPPINGS)
+    else:
+        if path.lower().endswith('.csv'):
+            df = read_usage_csv(path, COLUMN_MAPPINGS)
+        elif path.lower().endswith('.xlsx'):
+            df = read_usage_xlsx(path, ingest_columns(COLUMN_MAPPINGS))
+        else:
+            df = pd.read_excel(path)
+        df = validate_csv(df, show_messages=False)
+        if df is not None:
+            df = consolidate_accounts(normalize_metrics(df))
+
+    if df is not None:
+        df = compact_usage_frame(df)
+        usage_cache.store(key, df)
+    return df
+
+def _json_default(value):
+    """Convert numpy scalars and frames for json.dump"""
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, pd.DataFrame):
+        return value.to_dict('records')
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+def _init_worker(mappings):
+    global _worker_mappings
+    _worker_mappings = mappings
+
+def process_usage_file(path, output_dir, report_month=None, chunksize=None):
+    """Build the workbook and integrity summary for one usage file
+
+    Returns a summary dict; 'status' is 'ok', 'failed' (integrity check did
+    not pass) or 'error' (the file could not be read, validated or
+    processed; 'error' holds the message).
+    """
+    started = time.perf_counter()
+    name = os.path.splitext(os.path.basename(path))[0]
+    summary = {'input': path, 'status': 'error'}
+
+    try:
+        df = read_usage_file(path, chunksize)
+    except Exception as e:
+        summary['error'] = f"Error reading file: {e}"
+        return summary
+    if df is None:
+        summary['error'] = "Missing required columns: ['Account Number']"
+        return summary
+
+    # Any failure is reported for this file only, so the rest of the batch still runs
+    try:
+        account_index = build_account_index(df)
+        workbook_path = os.path.join(output_dir, f'{name}_billing.xlsx')
+        _, processed_accounts = create_consolidated_billing_file(
+            df, _worker_mappings, account_index, report_month, path=workbook_path
+        )
+        validation = validate_data_integrity(df, _worker_mappings, processed_accounts, account_index)
+
+        summary.update(validation)
+        summary['merged_rows'] = df.attrs.get('merged_rows', 0)
+        summary['status'] = 'ok' if validation['validation_passed'] else 'failed'
+        summary['workbook'] = workbook_path
+        summary['elapsed_seconds'] = round(time.perf_counter() - started, 3)
+
+        summary_path = os.path.join(output_dir, f'{name}_integrity.json')
+        with open(summary_path, 'w') as f:
+            json.dump(summary, f, indent=2, default=_json_default)
+        summary['summary'] = summary_path
+    except Exception as e:
+        return {'input': path, 'status': 'error', 'error': f"Error processing file: {e}"}
+    return summary
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Build consolidated billing workbooks for many usage files")
+    parser.add_argument('inputs', nargs='+', help="usage files, directories or glob patterns")
+    parser.add_argument('--output-dir', default='billing_reports', help="directory for workbooks and summaries")
+    parser.add_argument('--month', help="report title month, e.g. 'June 2025' (default: current month)")
+    parser.add_argument('--workers', type=int, default=None, help="worker processes (default: CPU count)")
+    parser.add_argument('--chunksize', type=int, default=None, help="stream CSV inputs in chunks of this many rows")
+    parser.add_argument('--mappings-db', default=MAPPINGS_DB, help="account mapping database")
+    parser.add_argument('--mappings-json', default=MAPPINGS_JSON, help="legacy JSON mappings imported into a new database")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    """Process every input file; exit status is 1 if any file errors or fails validation"""
+    args = parse_args(argv)
+    paths = find_usage_files(args.inputs)
+    if not paths:
+        print("No usage files found", file=sys.stderr)
+        return 1
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    mappings = dict(get_mapping_store(args.mappings_db, args.mappings_json).load())
+
+    exit_code = 0
+    with ProcessPoolExecutor(max_workers=args.workers, initializer=_init_worker, initargs=(mappings,)) as pool:
+        futures = [
+            pool.submit(process_usage_file, path, args.output_dir, args.month, args.chunksize)
+            for path in paths
+        ]
+        for future in as_completed(futures):
+            summary = future.result()
+            if summary['status'] == 'ok':
+                print(f"OK      {summary['input']} -> {summary['workbook']}")
+                continue
+
+            exit_code = 1
+            if summary['status'] == 'error':
+                print(f"ERROR   {summary['input']}: {summary['error']}", file=sys.stderr)
+            else:
+                print(
+                    f"FAILED  {summary['input']}: {len(summary['unmapped_accounts'])} unmapped, "
+                    f"{len(summary['missing_accounts'])} missing accounts, "
+                    f"totals match: {summary['data_totals_match']} (see {summary['summary']})",
+                    file=sys.stderr
+                )
+    return exit_code
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,817 @@
+"""
+Billing Engine
+Vectorized aggregation shared by the Client Billing Manager and the
+standalone Client Sort & Format tool
+"""
+
+import hashlib
+import os
+import sys
+import tempfile
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import openpyxl
+import pandas as pd
+
+from billing_rules import get_billing_rules, numeric_column
+
+# Order in which billing groups appear in the consolidated report
+BILLING_GROUP_ORDER = [
+    "BTTW GROUP",
+    "BIG BRAND TIRE GROUP",
+    "Sylvan Learning",
+    "Truckfitters",
+    "INDEPENDENTS"
+]
+
+REPORT_HEADERS = ['Account', 'Account Name', 'Calls Total', 'Minutes quantity', 'Messages quantity', 'Transcription Minutes', 'AskAI quantity', 'Numbers quantity']
+
+# Metric columns as they appear in the report (everything after Account / Account Name)
+METRIC_COLUMNS = REPORT_HEADERS[2:]
+
+# Normalized input columns the consolidated report and integrity check read
+REPORT_INPUT_COLUMNS = ['Account Number', 'Account Name'] + METRIC_COLUMNS
+
+# Labels used in the reconciliation table
+UNMAPPED_GROUP = 'UNMAPPED'
+ALL_GROUPS = 'ALL GROUPS'
+
+# Rows per chunk when streaming large usage files
+INGEST_CHUNK_ROWS = 50000
+
+# Bytes read at a time when hashing files
+HASH_BLOCK_BYTES = 1024 * 1024
+
+# Rows searched for the header row of an Excel upload
+XLSX_HEADER_SCAN_ROWS = 20
+
+# Budget for the shared result cache (parsed frames in memory, report files on disk)
+RESULT_CACHE_MAX_BYTES = 512 * 1024 * 1024
+
+# Memory budget for resolved column plans of known upload layouts
+COLUMN_PLAN_CACHE_MAX_BYTES = 4 * 1024 * 1024
+
+# Text columns with at most this share of distinct values are stored as categoricals
+CATEGORY_MAX_UNIQUE_RATIO = 0.5
+
+# Raw quantity columns coerced to floats by the normalization stage
+QUANTITY_COLUMNS = ['Calls Total', 'Minutes quantity', 'Messages Total', 'Messages quantity', 'Transcriptions quantity', 'AskAI quantity', 'Numbers quantity']
+
+def is_normalized(df):
+    """Check whether a frame has already been through normalize_metrics"""
+    return bool(df.attrs.get('normalized'))
+
+def normalize_metrics(df, rules=None):
+    """Convert every metric column to floats in a single pass
+
+    Runs once after validate_csv. Afterwards:
+      - quantity columns are floats with missing/unparseable values as 0
+      - column fallbacks and unit conversions from the billing rules are
+        applied (by default Messages quantity holds Messages Total when that
+        column exists, and Transcription Minutes holds the parsed
+        Transcriptions cost / $0.02, falling back to Transcriptions quantity)
+    so downstream code reads METRIC_COLUMNS directly without re-parsing strings.
+    """
+    if rules is None:
+        rules = get_billing_rules()
+    df = df.copy()
+
+    for column in QUANTITY_COLUMNS:
+        if column in df.columns:
+            df[column] = numeric_column(df, column)
+
+    for derive in rules['derive']:
+        derive(df)
+
+    # Metrics absent from the upload count as 0
+    for column in METRIC_COLUMNS:
+        if column not in df.columns:
+            df[column] = 0.0
+
+    df.attrs['normalized'] = True
+    return df
+
+def ensure_normalized(df):
+    """Return df normalized, skipping the work if it already is"""
+    return df if is_normalized(df) else normalize_metrics(df)
+
+def build_account_index(df):
+    """Map each account number to the position of its first row in df
+
+    Built once when a file is validated and kept with the session data so
+    membership tests and row lookups are O(1) dict operations.
+    """
+    accounts = df['Account Number'].astype(str)
+    first_rows = ~accounts.duplicated()
+    return dict(zip(accounts[first_rows].tolist(), np.flatnonzero(first_rows.to_numpy()).tolist()))
+
+def consolidate_accounts(df):
+    """Merge rows that share an account number into one row per account
+
+    Duplicate account numbers are found with one hash groupby (accounts keep
+    their first-seen order); metric and quantity columns are summed and
+    every other column keeps the account's first row. attrs['input_totals']
+    keeps the totals and record count of the original rows, and
+    attrs['merged_rows'] counts the rows folded into an earlier one.
+    Frames without duplicates are returned unchanged.
+    """
+    df = ensure_normalized(df)
+    accounts = df['Account Number'].astype(str)
+    merged_rows = int(accounts.duplicated().sum())
+    if not merged_rows:
+        return df
+
+    summed = [column for column in df.columns if column in METRIC_COLUMNS or column in QUANTITY_COLUMNS]
+    first = [column for column in df.columns if column not in summed and column != 'Account Number']
+    grouped = df.groupby(accounts, sort=False)
+    consolidated = pd.concat([grouped[summed].sum(), grouped[first].first(skipna=False)], axis=1)
+    consolidated = consolidated.reset_index()[df.columns]
+    consolidated.attrs.update(df.attrs)
+    consolidated.attrs['input_totals'] = input_totals(df)
+    consolidated.attrs['merged_rows'] = df.attrs.get('merged_rows', 0) + merged_rows
+    return consolidated
+
+def input_totals(df):
+    """Metric totals and record count over every input row
+
+    Streamed account summaries carry these from ingest; full frames compute them directly.
+    """
+    if 'input_totals' in df.attrs:
+        return dict(df.attrs['input_totals'])
+    df = ensure_normalized(df)
+    totals = df[METRIC_COLUMNS].sum().to_dict()
+    totals['records'] = len(df)
+    return totals
+
+def frame_memory_bytes(df):
+    """Deep memory usage of a frame in bytes"""
+    return int(df.memory_usage(deep=True).sum())
+
+def _compact_column(column):
+    """Smallest lossless dtype for one column"""
+    kind = column.dtype.kind
+    if kind in 'iuf':
+        values = column.to_numpy()
+        if kind == 'f' and not (np.isfinite(values).all() and np.array_equal(np.floor(values), values)):
+            # Fractional or missing values: float32 only where it round-trips exactly
+            smaller = values.astype(np.float32)
+            return column.astype(np.float32) if np.array_equal(smaller, values, equal_nan=True) else column
+        unsigned = len(values) == 0 or values.min() >= 0
+        return pd.to_numeric(column, downcast='unsigned' if unsigned else 'integer')
+    if kind == 'O' or isinstance(column.dtype, pd.StringDtype):
+        if column.nunique(dropna=False) <= CATEGORY_MAX_UNIQUE_RATIO * len(column):
+            return column.astype('category')
+    return column
+
+def compact_usage_frame(df):
+    """Convert a normalized frame to compact dtypes before it is kept in the session
+
+    Whole-number metrics become the smallest integer type that holds them,
+    other floats become float32 where that is exact, and repetitive text
+    columns (accounts listed on several rows, plan names) become
+    categoricals. Values are unchanged, so reports and totals are identical.
+    The deep memory size before and after is kept in attrs['memory_bytes'].
+    """
+    before = frame_memory_bytes(df)
+    compact = pd.DataFrame({column: _compact_column(df[column]) for column in df.columns}, index=df.index)
+    compact.attrs.update(df.attrs)
+    compact.attrs['memory_bytes'] = [before, frame_memory_bytes(compact)]
+    return compact
+
+def summarize_usage_chunks(chunks):
+    """Fold validated, normalized chunks into one row per account plus running totals
+
+    Each chunk is consolidated (see consolidate_accounts) and folded into a
+    running summary, so an account's metrics are summed over every row it
+    has anywhere in the file while the frame held in memory is bounded by
+    the number of distinct accounts plus one chunk, not the number of input
+    rows. Group totals are rolled up from these account rows at aggregation
+    time, which keeps the summary valid when mappings change. Returns None
+    if there were no rows.
+    """
+    summary = None
+    totals = dict.fromkeys(METRIC_COLUMNS, 0.0)
+    records = 0
+
+    for chunk in chunks:
+        records += len(chunk)
+        chunk_totals = chunk[METRIC_COLUMNS].sum()
+        for column in METRIC_COLUMNS:
+            totals[column] += chunk_totals[column]
+
+        chunk_rows = consolidate_accounts(chunk)
+        if summary is None:
+            summary = chunk_rows
+            continue
+        # concat drops attrs that differ between frames; the rows are already normalized
+        # and must not be normalized again (derived columns hold sums now)
+        combined = pd.concat([summary, chunk_rows], ignore_index=True)
+        combined.attrs['normalized'] = True
+        summary = consolidate_accounts(combined)
+
+    if not records:
+        return None
+
+    summary.attrs['input_totals'] = dict(totals, records=records)
+    summary.attrs['merged_rows'] = records - len(summary)
+    summary.attrs['normalized'] = True
+    return summary
+
+def stream_usage_csv(source, validate, chunksize=INGEST_CHUNK_ROWS, column_mappings=None, **read_csv_kwargs):
+    """Read a usage CSV in fixed-size chunks and return its account summary
+
+    validate is the app's validate_csv; it is called quietly on each chunk.
+    With column_mappings, only the columns the validator recognizes are
+    parsed (see csv_read_plan); quantities are left to normalization to
+    coerce, since a bad value cannot be retried mid-stream.
+    Returns None if a chunk fails validation or the file has no rows.
+    """
+    if column_mappings is not None:
+        plan = csv_read_plan(source, column_mappings, **read_csv_kwargs)
+        plan['dtype'] = {name: kind for name, kind in plan['dtype'].items() if kind is str}
+        read_csv_kwargs.update(plan)
+    failed = []
+
+    def validated_chunks():
+        for chunk in pd.read_csv(source, chunksize=chunksize, **read_csv_kwargs):
+            chunk = validate(chunk, show_messages=False)
+            if chunk is None:
+                failed.append(True)
+                return
+            yield normalize_metrics(chunk)
+
+    summary = summarize_usage_chunks(validated_chunks())
+    return None if failed else summary
+
+def ingest_columns(column_mappings, rules=None):
+    """Lower-case header names worth reading from an upload
+
+    The validator's aliases and their targets, plus every column
+    normalization reads; anything else in a vendor export is skipped.
+    """
+    if rules is None:
+        rules = get_billing_rules()
+    names = set(column_mappings) | set(column_mappings.values()) | set(QUANTITY_COLUMNS) | set(rules['source_columns'])
+    names |= {'Account', 'Account Number', 'Account Name'}
+    return {name.lower() for name in names}
+
+def csv_read_plan(source, column_mappings, rules=None, **read_csv_kwargs):
+    """Sniff a CSV header and return read_csv arguments that project and type it
+
+    Only the header line is parsed. Returns {'usecols', 'dtype'}: columns in
+    ingest_columns(column_mappings), with account columns read as strings
+    and quantity columns as floats. Rewinds file-like sources.
+    """
+    header = pd.read_csv(source, nrows=0, **read_csv_kwargs).columns
+    if hasattr(source, 'seek'):
+        source.seek(0)
+
+    wanted = ingest_columns(column_mappings, rules)
+    quantity_columns = {column.lower() for column in QUANTITY_COLUMNS}
+    usecols, dtype = [], {}
+    for name in header:
+        key = str(name).strip().lower()
+        if key not in wanted:
+            continue
+        usecols.append(name)
+        target = column_mappings.get(key, name)
+        if target in ('Account Number', 'Account Name') or key in ('account', 'account number', 'account name'):
+            dtype[name] = str
+        elif target.lower() in quantity_columns or key in quantity_columns:
+            dtype[name] = 'float64'
+    return {'usecols': usecols, 'dtype': dtype}
+
+def read_usage_csv(source, column_mappings, **read_csv_kwargs):
+    """Read only the recognized columns of a usage CSV, with explicit dtypes
+
+    If a quantity column holds text (e.g. 'N/A') the file is re-read with
+    those columns untyped and normalization coerces them as before.
+    """
+    plan = csv_read_plan(source, column_mappings, **read_csv_kwargs)
+    try:
+        return pd.read_csv(source, **plan, **read_csv_kwargs)
+    except ValueError as e:
+        if isinstance(e, pd.errors.ParserError):
+            raise
+        if hasattr(source, 'seek'):
+            source.seek(0)
+        plan['dtype'] = {name: kind for name, kind in plan['dtype'].items() if kind is str}
+        return pd.read_csv(source, **plan, **read_csv_kwargs)
+
+def _typed_array(values):
+    """Column array with read_excel's typing: int64, float64 (blanks as NaN) or object"""
+    present = [value for value in values if value is not None]
+    if present and all(isinstance(value, int) and not isinstance(value, bool) for value in present):
+        if len(present) == len(values):
+            return np.array(values, dtype=np.int64)
+        return np.array([np.nan if value is None else value for value in values], dtype=np.float64)
+    if present and all(isinstance(value, (int, float)) and not isinstance(value, bool) for value in present):
+        return np.array([np.nan if value is None else value for value in values], dtype=np.float64)
+    return np.array([np.nan if value is None else value for value in values], dtype=object)
+
+def read_usage_xlsx(source, columns=None, header_scan_rows=XLSX_HEADER_SCAN_ROWS):
+    """Stream the first sheet of a usage workbook with openpyxl's read-only mode
+
+    The header is the first row (within header_scan_rows) that names an
+    account column, falling back to the first non-empty row. Only headers whose
+    lower-case name is in columns are kept (all when columns is None);
+    rows are read one at a time into per-column lists and typed like
+    read_excel would. Fully blank rows are skipped.
+    """
+    workbook = openpyxl.load_workbook(source, read_only=True, data_only=True)
+    try:
+        worksheet = workbook.worksheets[0]
+        header_row, header = None, None
+        for row_number, row in enumerate(worksheet.iter_rows(max_row=header_scan_rows, values_only=True), start=1):
+            names = [str(value).strip().lower() for value in row if value is not None]
+            if header is None and names:
+                header_row, header = row_number, row
+            if 'account' in names or 'account number' in names:
+                header_row, header = row_number, row
+                break
+        if header is None:
+            return pd.DataFrame()
+
+        names = ['' if value is None else str(value).strip() for value in header]
+        keep = [
+            position for position, name in enumerate(names)
+            if name and (columns is None or name.lower() in columns)
+        ]
+        data = [[] for _ in keep]
+        for row in worksheet.iter_rows(min_row=header_row + 1, values_only=True):
+            values = [row[position] if position < len(row) else None for position in keep]
+            if all(value is None for value in values):
+                continue
+            for column_values, value in zip(data, values):
+                column_values.append(value)
+    finally:
+        workbook.close()
+
+    df = pd.DataFrame({position: _typed_array(values) for position, values in enumerate(data)})
+    df.columns = [names[position] for position in keep]
+    return df
+
+def aggregate_billing(df, mappings, account_index=None, rules=None):
+    """Join mappings onto the usage data and compute account, group and global totals
+
+    Returns a dict with:
+      accounts           - one row per mapped account, in report order (raw metrics)
+      groups             - one row per billing group with account count and totals
+                           (including the rules' group multipliers)
+      global_totals      - totals and record count over every input row,
+                           including multipliers
+      processed_accounts - mapped accounts found in the data, in mapping order
+    """
+    df = ensure_normalized(df)
+
+    # Each account is reported from its first row
+    if account_index is None:
+        account_index = build_account_index(df)
+    accounts = _account_rows(df, list(account_index.values()))
+
+    mapping_frame = pd.DataFrame({
+        'Account Number': [str(account) for account in mappings.keys()],
+        'Billing Group': list(mappings.values())
+    })
+    mapped = mapping_frame.merge(accounts, on='Account Number', how='inner')
+    processed_accounts = mapped['Account Number'].tolist()
+
+    # Apply group multipliers as one column operation per metric
+    if rules is None:
+        rules = get_billing_rules()
+    billed = {
+        metric: mapped[metric] * mapped['Billing Group'].map(factors).fillna(1)
+        for metric, factors in rules['multipliers'].items()
+    }
+
+    # Sum in float64: compact account dtypes (uint8, float32) would overflow or lose precision
+    groups = mapped[['Billing Group'] + METRIC_COLUMNS].astype(dict.fromkeys(METRIC_COLUMNS, 'float64')).assign(**billed)
+    groups = groups.groupby('Billing Group', sort=False).agg(
+        accounts=('Billing Group', 'size'),
+        **{column: (column, 'sum') for column in METRIC_COLUMNS}
+    )
+
+    global_totals = input_totals(df)
+    for metric, billed_values in billed.items():
+        global_totals[metric] += (billed_values - mapped[metric]).sum()
+
+    return {
+        'accounts': _in_report_order(mapped),
+        'groups': groups,
+        'global_totals': global_totals,
+        'processed_accounts': processed_accounts
+    }
+
+def _account_rows(df, positions):
+    """Account Number, Account Name and metric columns for the rows at positions"""
+    rows = df[METRIC_COLUMNS].take(positions)
+    rows.insert(0, 'Account Number', df['Account Number'].take(positions).astype(str))
+    if 'Account Name' in df.columns:
+        names = df['Account Name'].take(positions)
+        if isinstance(names.dtype, pd.CategoricalDtype):
+            names = names.astype(names.cat.categories.dtype)
+        rows.insert(1, 'Account Name', names.fillna('Unknown'))
+    else:
+        rows.insert(1, 'Account Name', 'Unknown')
+    return rows
+
+def _in_report_order(accounts):
+    """Sort account rows by group order, then alphabetically by account name
+
+    Accounts with the same name are ordered by account number, so the order
+    does not depend on how the rows were assembled.
+    """
+    group_rank = {group: rank for rank, group in enumerate(BILLING_GROUP_ORDER)}
+    order = pd.DataFrame({
+        'group': accounts['Billing Group'].map(group_rank).fillna(len(group_rank)).to_numpy(),
+        'name': accounts['Account Name'].astype(str).str.upper().to_numpy(),
+        'account': accounts['Account Number'].to_numpy()
+    })
+    return accounts.take(order.sort_values(['group', 'name', 'account']).index).reset_index(drop=True)
+
+def reassign_accounts(aggregate, df, account_index, changes, rules=None):
+    """Move accounts between billing groups in an aggregate_billing result
+
+    changes maps account -> (old_group, new_group), old_group None for
+    accounts that were unmapped. Each account's metrics are subtracted from
+    its old group's totals and added to the new group's (with the rules'
+    multipliers), so group and global totals are adjusted by sums over the
+    changed accounts only rather than re-aggregated; the account list is
+    patched and re-sorted in one vectorized step. Accounts not in the data are ignored. Returns a new
+    aggregate and leaves the input untouched, as it may be shared.
+    """
+    df = ensure_normalized(df)
+    if rules is None:
+        rules = get_billing_rules()
+    changes = {
+        str(account): groups for account, groups in changes.items()
+        if str(account) in account_index and groups[0] != groups[1]
+    }
+    if not changes:
+        return aggregate
+
+    # One signed row per account per side of the move: out of the old group, into the new one
+    moves = pd.DataFrame(
+        [(old_group, -1, account_index[account]) for account, (old_group, _) in changes.items() if old_group is not None]
+        + [(new_group, 1, account_index[account]) for account, (_, new_group) in changes.items()],
+        columns=['group', 'sign', 'row']
+    )
+    values = df[METRIC_COLUMNS].take(moves['row']).to_numpy(dtype=float)
+    multipliers = np.array([
+        [rules['multipliers'].get(metric, {}).get(group_name, 1) for metric in METRIC_COLUMNS]
+        for group_name in moves['group']
+    ], dtype=float)
+    signs = moves['sign'].to_numpy(dtype=float)[:, None]
+    billed = values * multipliers * signs
+    delta = pd.DataFrame(billed, columns=METRIC_COLUMNS)
+    delta['accounts'] = moves['sign']
+    delta = delta.groupby(moves['group'], sort=False).sum()
+
+    # Global totals count every input row once, plus each mapped account's multiplier surplus
+    global_totals = dict(aggregate['global_totals'])
+    for metric, surplus in zip(METRIC_COLUMNS, (billed - values * signs).sum(axis=0)):
+        global_totals[metric] += surplus
+
+    groups = aggregate['groups'].astype(float)
+    groups = groups.reindex(groups.index.append(delta.index.difference(groups.index)), fill_value=0.0)
+    groups = groups + delta.reindex(index=groups.index, columns=groups.columns, fill_value=0.0)
+    # Metric totals stay float64 as in aggregate_billing; only the account count is an integer
+    groups = groups[groups['accounts'] > 0].astype({'accounts': aggregate['groups']['accounts'].dtype})
+    groups = groups.rename_axis(aggregate['groups'].index.name)
+
+    accounts = aggregate['accounts']
+    new_groups = {account: new_group for account, (_, new_group) in changes.items()}
+    accounts = accounts.assign(**{
+        'Billing Group': accounts['Account Number'].map(new_groups).fillna(accounts['Billing Group'])
+    })
+    added = [account for account, (old_group, _) in changes.items() if old_group is None]
+    if added:
+        rows = _account_rows(df, [account_index[account] for account in added])
+        rows.insert(1, 'Billing Group', [new_groups[account] for account in added])
+        accounts = pd.concat([accounts, rows[accounts.columns]], ignore_index=True)
+
+    return {
+        'accounts': _in_report_order(accounts),
+        'groups': groups,
+        'global_totals': global_totals,
+        'processed_accounts': aggregate['processed_accounts'] + added
+    }
+
+def reconcile_totals(df, mappings, processed_accounts, account_index=None, tolerance=0.01):
+    """Compare input totals with processed account rows, per billing group and metric
+
+    Input rows are joined to their billing group (UNMAPPED_GROUP if none) and
+    summed; processed accounts are summed from the rows the report uses
+    (no multipliers). An ALL_GROUPS row per metric compares the totals over
+    every input row with the processed total. Returns a long table with
+    columns Billing Group, Metric, Input, Processed, Difference, Matches.
+    """
+    df = ensure_normalized(df)
+    if account_index is None:
+        account_index = build_account_index(df)
+
+    group_lookup = pd.Series(list(mappings.values()), index=[str(account) for account in mappings.keys()], dtype=object)
+    input_groups = df['Account Number'].astype(str).map(group_lookup).fillna(UNMAPPED_GROUP)
+    input_by_group = df[METRIC_COLUMNS].groupby(input_groups).sum()
+
+    processed_positions = [account_index[account] for account in processed_accounts if account in account_index]
+    processed = df.take(processed_positions)
+    processed_groups = processed['Account Number'].astype(str).map(group_lookup).fillna(UNMAPPED_GROUP)
+    processed_by_group = processed[METRIC_COLUMNS].groupby(processed_groups).sum()
+
+    totals = input_totals(df)
+    input_by_group.loc[ALL_GROUPS] = [totals[column] for column in METRIC_COLUMNS]
+    processed_by_group.loc[ALL_GROUPS] = processed[METRIC_COLUMNS].sum()
+
+    reconciliation = pd.concat(
+        {'Input': input_by_group.stack(), 'Processed': processed_by_group.stack()},
+        axis=1
+    ).fillna(0.0)
+    reconciliation.index.names = ['Billing Group', 'Metric']
+    reconciliation['Difference'] = reconciliation['Processed'] - reconciliation['Input']
+    reconciliation['Matches'] = reconciliation['Difference'].abs() <= tolerance
+    return reconciliation.reset_index()
+
+def account_report_rows(accounts):
+    """Pre-format account rows for the report: numbers as ints, zeros as blank cells"""
+    values = accounts[METRIC_COLUMNS].to_numpy(dtype=float)
+    cells = values.astype(np.int64).astype(object)
+    cells[~(values > 0)] = ''
+    return [
+        [account_number, account_name] + metrics
+        for account_number, account_name, metrics in zip(
+            accounts['Account Number'].tolist(),
+            accounts['Account Name'].tolist(),
+            cells.tolist()
+        )
+    ]
+
+def write_consolidated_sheet(worksheet, aggregate, title, header_format, group_format, account_format=None, global_row=True):
+    """Write an aggregate produced by aggregate_billing in the consolidated report layout
+
+    Rows are written top to bottom with write_row, so the worksheet may come
+    from a constant_memory workbook. Without global_row the GLOBAL TOTALS
+    line is left out (single-group reports).
+    """
+    global_totals = aggregate['global_totals']
+    groups = aggregate['groups']
+    accounts = aggregate['accounts']
+
+    # Write header
+    worksheet.merge_range(0, 0, 0, 7, title, header_format)
+    row = 1
+
+    # Write global summary in line 2
+    if global_row:
+        worksheet.write_row(row, 0, [
+            'GLOBAL TOTALS',
+            f"{global_totals['records']} accounts"
+        ] + [int(global_totals[column]) for column in METRIC_COLUMNS], group_format)
+        row += 1
+
+    # Column headers
+    worksheet.write_row(row, 0, REPORT_HEADERS, header_format)
+    row += 1
+    header_rows = row
+
+    # Individual accounts show original values (no multiplier applied)
+    rows_by_group = {}
+    for group_name, cells in zip(accounts['Billing Group'].tolist(), account_report_rows(accounts)):
+        rows_by_group.setdefault(group_name, []).append(cells)
+
+    # Process each group in specific order
+    for group_name in BILLING_GROUP_ORDER:
+        if group_name not in groups.index:
+            continue
+
+        group_totals = groups.loc[group_name]
+
+        # Write group summary row
+        worksheet.write_row(row, 0, [
+            group_name,
+            f"{int(group_totals['accounts'])} accounts"
+        ] + [int(group_totals[column]) for column in METRIC_COLUMNS], group_format)
+        row += 1
+
+        for cells in rows_by_group.get(group_name, []):
+            worksheet.write_row(row, 0, cells, account_format)
+            row += 1
+
+        # Add blank row between groups
+        row += 1
+
+    # Auto-adjust column widths
+    worksheet.set_column(0, 0, 15)  # Account
+    worksheet.set_column(1, 1, 25)  # Account Name
+    worksheet.set_column(2, 7, 15)  # All quantity columns
+
+    # Freeze the header row
+    worksheet.freeze_panes(header_rows, 0)
+
+def split_aggregate(aggregate):
+    """Split an aggregate_billing result into one aggregate per report group
+
+    Each part holds that group's accounts and summary row, and its
+    global_totals are the group's (billed) totals, so a part can be written
+    as a report of its own. Groups outside BILLING_GROUP_ORDER are left out,
+    as in the consolidated report. Returns {group: aggregate}, in report order.
+    """
+    groups = aggregate['groups']
+    accounts_by_group = dict(tuple(aggregate['accounts'].groupby('Billing Group', sort=False)))
+    parts = {}
+    for group_name in BILLING_GROUP_ORDER:
+        if group_name not in groups.index:
+            continue
+        accounts = accounts_by_group[group_name].reset_index(drop=True)
+        totals = {column: groups.at[group_name, column] for column in METRIC_COLUMNS}
+        totals['records'] = int(groups.at[group_name, 'accounts'])
+        parts[group_name] = {
+            'accounts': accounts,
+            'groups': groups.loc[[group_name]],
+            'global_totals': totals,
+            'processed_accounts': accounts['Account Number'].tolist()
+        }
+    return parts
+
+class ReportFile:
+    """A finished workbook on disk, deleted once nothing references it
+
+    Lets cached reports stay in a temp file instead of being held in memory
+    as bytes; pass read_bytes to st.download_button so the file is only read
+    when the user downloads it.
+    """
+
+    def __init__(self, suffix='.xlsx'):
+        handle, self.path = tempfile.mkstemp(prefix='billing_report_', suffix=suffix)
+        os.close(handle)
+
+    def open(self):
+        """Open the file for reading"""
+        return open(self.path, 'rb')
+
+    def read_bytes(self):
+        """Return the file contents"""
+        with self.open() as f:
+            return f.read()
+
+    def size(self):
+        """Bytes on disk, 0 if the file is gone"""
+        try:
+            return os.path.getsize(self.path)
+        except OSError:
+            return 0
+
+    def __del__(self):
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+def content_hash(data):
+    """SHA-256 hex digest of uploaded file bytes, used as the data version"""
+    return hashlib.sha256(data).hexdigest()
+
+def file_hash(source):
+    """content_hash of a file path or binary file object, read in fixed-size blocks
+
+    The file is never held in memory as a whole. File objects are rewound
+    before and after hashing.
+    """
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, 'rb') as f:
+            return file_hash(f)
+
+    digest = hashlib.sha256()
+    source.seek(0)
+    for block in iter(lambda: source.read(HASH_BLOCK_BYTES), b''):
+        digest.update(block)
+    source.seek(0)
+    return digest.hexdigest()
+
+def file_version(path):
+    """Cheap change token for a file (modification time and size), None if missing"""
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return f"{stat.st_mtime_ns}-{stat.st_size}"
+
+def _estimate_size(value):
+    """Approximate memory held by a cached value in bytes
+
+    Report files count their size on disk, so cached workbooks and ZIPs are
+    evicted (and their temp files deleted) within the same budget.
+    """
+    if isinstance(value, ReportFile):
+        return sys.getsizeof(value) + value.size()
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(deep=True).sum())
+    if isinstance(value, (bytes, bytearray)):
+        return len(value)
+    if isinstance(value, (tuple, list)):
+        return sys.getsizeof(value) + sum(_estimate_size(item) for item in value)
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(_estimate_size(item) for item in value.values())
+    return sys.getsizeof(value)
+
+class ResultCache:
+    """Thread-safe LRU cache that evicts entries once a byte budget is exceeded
+
+    Lives at module level so it survives Streamlit reruns and is shared by every
+    session on the server. Keys must therefore be built from content (upload
+    hashes, mapping versions) rather than from session state, and cached values
+    must be treated as read-only.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Return the cached value for key, or None on a miss"""
+        with self._lock:
+            if key not in self._entries:
+                return None
+            self._entries.move_to_end(key)
+            return self._entries[key][0]
+
+    def put(self, key, value):
+        """Store a value, evicting the least recently used entries as needed
+
+        Returns False if the value is None or larger than the whole budget and was not stored.
+        """
+        if value is None:
+            return False
+
+        size = _estimate_size(value)
+        if size > self.max_bytes:
+            return False
+
+        with self._lock:
+            if key in self._entries:
+                self._total_bytes -= self._entries.pop(key)[1]
+            self._entries[key] = (value, size)
+            self._total_bytes += size
+            while self._total_bytes > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self._total_bytes -= evicted_size
+        return True
+
+    def get_or_compute(self, key, compute):
+        """Return the cached value for key, computing and storing it on a miss
+
+        None results are returned but not stored, so failed validations are retried.
+        """
+        value = self.get(key)
+        if value is not None:
+            return value
+
+        value = compute()
+        self.put(key, value)
+        return value
+
+    def clear(self):
+        """Drop every cached entry"""
+        with self._lock:
+            self._entries.clear()
+            self._total_bytes = 0
+
+# Shared across reruns and sessions within one server process
+result_cache = ResultCache(RESULT_CACHE_MAX_BYTES)
+
+# Column plans by validator and header fingerprint, shared like result_cache
+column_plan_cache = ResultCache(COLUMN_PLAN_CACHE_MAX_BYTES)
+
+def header_fingerprint(columns):
+    """SHA-256 of a header row's names in order, identifying an export layout"""
+    return hashlib.sha256('\x1f'.join(str(column) for column in columns).encode()).hexdigest()
+
+def cached_column_plan(validator, columns, resolve):
+    """Column plan for a header row, resolved once per layout
+
+    resolve(columns) runs the validator's rename heuristics; its plan is
+    kept under (validator, header_fingerprint(columns)). Returns
+    (plan, known), known being False the first time a layout is seen.
+    """
+    key = (validator, header_fingerprint(columns))
+    plan = column_plan_cache.get(key)
+    if plan is not None:
+        return plan, True
+    plan = resolve(list(columns))
+    column_plan_cache.put(key, plan)
+    return plan, False
+
+def apply_column_plan(df, plan):
+    """Rename columns and add missing ones with defaults, as a resolved plan says
+
+    plan['columns'] holds the final name of every column in order and
+    plan['defaults'] the value of each column to add.
+    """
+    df = df.set_axis(plan['columns'], axis=1)
+    if plan['defaults']:
+        df = df.assign(**plan['defaults'])
+    return df
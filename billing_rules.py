@@ -0,0 +1,157 @@
+"""
+Billing Rules
+Declarative column fallbacks, unit conversions, group multipliers and unit
+rates, compiled into whole-column operations
+
+Rules come from DEFAULT_BILLING_RULES, overridden section by section by an
+optional billing_rules.json next to the apps, e.g.
+
+    {
+        "group_multipliers": {"AskAI quantity": {"BIG BRAND TIRE GROUP": 7, "Truckfitters": 2}},
+        "unit_rates": {"Calls Total": 0.06}
+    }
+"""
+
+import copy
+import hashlib
+import json
+import os
+import threading
+
+import pandas as pd
+
+BILLING_RULES_FILE = 'billing_rules.json'
+
+DEFAULT_BILLING_RULES = {
+    # Metric column filled from the first source column present in the upload
+    'column_fallbacks': {
+        'Messages quantity': ['Messages Total', 'Messages quantity']
+    },
+    # Metric column derived as source / divide_by, falling back to another
+    # column where the source is missing or unparseable; derived values are
+    # rounded to 'decimals' places. Transcription minutes are billed from
+    # cost at $0.02 per minute, in whole minutes.
+    'unit_conversions': {
+        'Transcription Minutes': {
+            'source': 'Transcriptions cost',
+            'currency': True,
+            'divide_by': 0.02,
+            'decimals': 0,
+            'fallback': 'Transcriptions quantity'
+        }
+    },
+    # Per-group factors applied to a metric when billed (BBT AskAI is billed at 7x)
+    'group_multipliers': {
+        'AskAI quantity': {'BIG BRAND TIRE GROUP': 7}
+    },
+    # Price per unit for the cost column of the simple billing report
+    'unit_rates': {
+        'Calls Total': 0.05,
+        'Messages quantity': 0.02,
+        'AskAI quantity': 0.10
+    }
+}
+
+def numeric_column(df, column):
+    """Return a column as floats, treating missing or unparseable values as 0"""
+    if column not in df.columns:
+        return pd.Series(0.0, index=df.index)
+    return pd.to_numeric(df[column], errors='coerce').fillna(0.0).astype(float)
+
+def currency_column(df, column):
+    """Parse a '$1,234.56' style column to floats, leaving unparseable values as NaN"""
+    cleaned = df[column].astype(str).str.replace('$', '', regex=False).str.replace(',', '', regex=False)
+    return pd.to_numeric(cleaned, errors='coerce').where(df[column].notna())
+
+def _fallback_op(target, sources):
+    def apply(df):
+        for source in sources:
+            if source in df.columns:
+                df[target] = df[source]
+                return
+    return apply
+
+def _conversion_op(target, rule):
+    source = rule['source']
+    divide_by = rule.get('divide_by', 1)
+    decimals = rule.get('decimals')
+    fallback = rule.get('fallback')
+
+    def apply(df):
+        fallback_values = numeric_column(df, fallback) if fallback else pd.Series(0.0, index=df.index)
+        if source in df.columns:
+            if rule.get('currency'):
+                df[source] = currency_column(df, source)
+            derived = df[source] / divide_by
+            if decimals is not None:
+                derived = derived.round(decimals)
+            df[target] = derived.fillna(fallback_values)
+        else:
+            df[target] = fallback_values
+    return apply
+
+def compile_billing_rules(rules):
+    """Compile a rules dict into column operations
+
+    Returns a dict with:
+      derive         - functions that each set one metric column on a frame in place
+      source_columns - upload columns the derivations read
+      multipliers    - {metric: {group: factor}}, applied with one Series.map per metric
+      unit_rates     - {metric: price per unit}
+      version        - short hash of the rules, for cache keys
+    """
+    derive = [_fallback_op(target, sources) for target, sources in rules['column_fallbacks'].items()]
+    derive += [_conversion_op(target, rule) for target, rule in rules['unit_conversions'].items()]
+    source_columns = [source for sources in rules['column_fallbacks'].values() for source in sources]
+    source_columns += [
+        column for rule in rules['unit_conversions'].values()
+        for column in (rule['source'], rule.get('fallback')) if column
+    ]
+    return {
+        'derive': derive,
+        'source_columns': source_columns,
+        'multipliers': {metric: dict(factors) for metric, factors in rules['group_multipliers'].items() if factors},
+        'unit_rates': dict(rules['unit_rates']),
+        'version': hashlib.sha256(json.dumps(rules, sort_keys=True).encode()).hexdigest()[:12]
+    }
+
+def load_billing_rules(path=BILLING_RULES_FILE):
+    """Default rules with any sections from the JSON rules file merged in"""
+    rules = copy.deepcopy(DEFAULT_BILLING_RULES)
+    try:
+        with open(path, 'r') as f:
+            overrides = json.load(f)
+    except FileNotFoundError:
+        return rules
+    for section, entries in overrides.items():
+        if section not in rules:
+            raise ValueError(f"Unknown billing rules section: {section}")
+        for name, value in entries.items():
+            # Nested rules (multiplier tables, conversions) are merged key by key
+            if isinstance(value, dict) and isinstance(rules[section].get(name), dict):
+                rules[section][name].update(value)
+            else:
+                rules[section][name] = value
+    return rules
+
+_compiled = {}
+_compiled_lock = threading.Lock()
+
+def get_billing_rules(path=BILLING_RULES_FILE):
+    """Compiled rules for path, recompiled only when the file changes"""
+    try:
+        stat = os.stat(path)
+        file_version = (stat.st_mtime_ns, stat.st_size)
+    except FileNotFoundError:
+        file_version = None
+
+    with _compiled_lock:
+        cached = _compiled.get(path)
+        if cached is None or cached[0] != file_version:
+            cached = (file_version, compile_billing_rules(load_billing_rules(path)))
+            _compiled[path] = cached
+        return cached[1]
+
+def billing_rules_version(path=BILLING_RULES_FILE):
+    """Version of the active rules, changes whenever the rules file does"""
+    return get_billing_rules(path)['version']
@@ -0,0 +1,247 @@
+"""
+Billing UI
+Streamlit components shared by the Client Billing Manager and the
+standalone Client Sort & Format tool
+"""
+
+from datetime import datetime
+
+import pandas as pd
+import streamlit as st
+
+from billing_engine import file_hash
+from diagnostics import diagnostics_json, process_peak_rss_mb, stop_recording
+from history_store import MONTH_FORMAT
+
+# How often a pending report's progress bar refreshes
+REPORT_POLL_SECONDS = 0.5
+
+def parse_assignment_csv(uploaded_file, groups):
+    """Read an assignments CSV with account and group columns
+
+    Accepts 'Account' or 'Account Number' and 'Group' or 'Billing Group'
+    headers in any case. Returns ({account: group}, skipped_rows), or
+    (None, 0) if the required columns are missing.
+    """
+    assignments_df = pd.read_csv(uploaded_file, dtype=str)
+    columns = {col.strip().lower(): col for col in assignments_df.columns}
+    account_col = columns.get('account number', columns.get('account'))
+    group_col = columns.get('billing group', columns.get('group'))
+    if account_col is None or group_col is None:
+        return None, 0
+
+    assignments_df = assignments_df[[account_col, group_col]].dropna()
+    accounts = assignments_df[account_col].str.strip()
+    assigned_groups = assignments_df[group_col].str.strip()
+    valid = assigned_groups.isin(groups)
+    return dict(zip(accounts[valid], assigned_groups[valid])), int((~valid).sum())
+
+def upload_hash(uploaded_file, key='upload_hash'):
+    """file_hash of an uploaded file, computed once per upload
+
+    The hash is kept in session_state under the upload's file_id, so reruns
+    with the same upload do not read it again.
+    """
+    cached = st.session_state.get(key)
+    if cached is None or cached[0] != uploaded_file.file_id:
+        cached = (uploaded_file.file_id, file_hash(uploaded_file))
+        st.session_state[key] = cached
+    return cached[1]
+
+def render_bulk_assignment(df, new_accounts, account_index, groups, key='bulk'):
+    """Editable table for assigning every unmapped account at once
+
+    Pending choices ("assign all filtered", CSV imports and table edits) stay
+    in session_state until the user saves. Returns {account: group} when the
+    save button is pressed, otherwise None.
+    """
+    pending_key = f'{key}_pending'
+    editor_version_key = f'{key}_editor_version'
+    pending = st.session_state.setdefault(pending_key, {})
+    st.session_state.setdefault(editor_version_key, 0)
+
+    if 'Account Name' in df.columns:
+        names = df['Account Name'].take([account_index[account] for account in new_accounts]).tolist()
+    else:
+        names = [''] * len(new_accounts)
+    table = pd.DataFrame({'Account': new_accounts, 'Account Name': names})
+
+    # Filter accounts by number or name; a new filter starts a fresh editor
+    filter_text = st.text_input("Filter accounts", key=f'{key}_filter', placeholder="Account number or name contains...")
+    if st.session_state.get(f'{key}_last_filter') != filter_text:
+        st.session_state[f'{key}_last_filter'] = filter_text
+        st.session_state[editor_version_key] += 1
+    if filter_text:
+        matches = (
+            table['Account'].str.contains(filter_text, case=False, regex=False) |
+            table['Account Name'].astype(str).str.contains(filter_text, case=False, regex=False)
+        )
+        table = table[matches]
+
+    col1, col2 = st.columns([3, 1])
+    with col1:
+        bulk_group = st.selectbox(
+            f"Assign all {len(table)} filtered accounts to:",
+            ["Select group..."] + groups,
+            key=f'{key}_group'
+        )
+    with col2:
+        st.write("")
+        if st.button("Apply to filtered", key=f'{key}_apply') and bulk_group != "Select group...":
+            pending.update(dict.fromkeys(table['Account'], bulk_group))
+            st.session_state[editor_version_key] += 1
+
+    # Import assignments from CSV
+    assignments_file = st.file_uploader(
+        "Import assignments CSV (Account, Group)",
+        type=['csv'],
+        key=f'{key}_csv'
+    )
+    if assignments_file is not None and st.button("Import assignments", key=f'{key}_import'):
+        imported, skipped = parse_assignment_csv(assignments_file, groups)
+        if imported is None:
+            st.error("The assignments CSV needs Account and Group columns")
+        else:
+            unmapped = set(new_accounts)
+            imported = {account: group for account, group in imported.items() if account in unmapped}
+            pending.update(imported)
+            st.session_state[editor_version_key] += 1
+            st.success(f"Imported {len(imported)} assignments")
+            if skipped:
+                st.warning(f"Skipped {skipped} rows with unknown groups")
+
+    # Editable table; a new editor key resets its edit state after bulk changes
+    table = table.assign(Group=table['Account'].map(pending))
+    edited = st.data_editor(
+        table,
+        column_config={
+            'Account': st.column_config.TextColumn(disabled=True),
+            'Account Name': st.column_config.TextColumn(disabled=True),
+            'Group': st.column_config.SelectboxColumn(options=groups)
+        },
+        hide_index=True,
+        use_container_width=True,
+        key=f"{key}_editor_{st.session_state[editor_version_key]}"
+    )
+
+    # Fold table edits into the pending assignments
+    for account, group in zip(edited['Account'], edited['Group']):
+        if pd.isna(group):
+            pending.pop(account, None)
+        else:
+            pending[account] = group
+
+    if st.button(f"💾 Save {len(pending)} assignments", key=f'{key}_save', disabled=not pending):
+        assignments = dict(pending)
+        pending.clear()
+        st.session_state[editor_version_key] += 1
+        return assignments
+    return None
+
+def render_history_controls(store, load_accounts, key='history'):
+    """Month picker and save button for the usage history
+
+    load_accounts returns the per-account frame to record and is only called
+    when the user saves. Returns the selected 'YYYY-MM' month.
+    """
+    current = pd.Period.now('M')
+    months = [(current - offset).strftime(MONTH_FORMAT) for offset in range(24)]
+    recorded = store.months()
+
+    month = st.selectbox("Usage month", months, key=f'{key}_month')
+    replace = month in recorded
+    if replace:
+        st.caption(f"{month} is already recorded; the report includes a Month over Month sheet")
+
+    if st.button(f"Replace {month} in history" if replace else f"💾 Save as {month}", key=f'{key}_save'):
+        store.record_month(month, load_accounts(), replace=replace)
+        recorded = store.months()
+        st.success(f"Saved {month} to the usage history")
+
+    if recorded:
+        st.caption(f"Recorded months: {', '.join(recorded[-12:])}")
+    return month
+
+def render_diagnostics(recorder, key='diagnostics'):
+    """Collapsible Diagnostics section with the latest span for each pipeline stage
+
+    Cached steps do not run again on a rerun, so the most recent measured
+    span per stage is kept in session_state and shown until it is replaced.
+    """
+    stop_recording()
+    latest = st.session_state.setdefault(f'{key}_spans', {})
+    for record in recorder.spans:
+        latest[record['stage']] = record
+
+    with st.expander("🩺 Diagnostics"):
+        st.checkbox(
+            "Trace memory per stage",
+            key=f'{key}_trace_memory',
+            help="Record peak Python memory for each stage on the next run (slower)"
+        )
+        if not latest:
+            st.caption("No pipeline stages have run in this session yet")
+            return
+
+        spans = list(latest.values())
+        st.dataframe(pd.DataFrame(spans), hide_index=True, use_container_width=True)
+        rss = process_peak_rss_mb()
+        if rss is not None:
+            st.caption(f"Process peak memory: {rss:,.1f} MB")
+        st.download_button(
+            label="📥 Download diagnostics (JSON)",
+            data=diagnostics_json(spans),
+            file_name=f"billing_diagnostics_{datetime.now().strftime('%Y-%m-%d_%H%M%S')}.json",
+            mime="application/json",
+            key=f'{key}_download'
+        )
+
+@st.fragment(run_every=REPORT_POLL_SECONDS)
+def render_report_progress(job, label="Building report", diagnostics_key='diagnostics'):
+    """Progress bar for a report building in the background
+
+    Only this fragment refreshes while the job runs, so the rest of the page
+    stays usable. Once the job finishes, its spans are added to the
+    Diagnostics section and the whole page reruns to show the result.
+    """
+    if job.done():
+        latest = st.session_state.setdefault(f'{diagnostics_key}_spans', {})
+        for record in job.spans():
+            latest[record['stage']] = record
+        st.rerun()
+
+    stage = job.current_stage()
+    st.progress(
+        job.progress(),
+        text=f"{label}{f' ({stage})' if stage else ''}... {job.elapsed():.0f}s"
+    )
+
+def render_job_download(jobs, job_key, build, stages, title, file_name, mime, key):
+    """Build-on-request background download of a file
+
+    Shows a "Build <title>" button that submits build (returning a
+    ReportFile) to jobs, a progress bar while it runs, then a download
+    button for the finished file. Results are shared through job_key, so
+    other sessions with the same data get the download straight away.
+    """
+    job = jobs.get(job_key)
+    if job is None:
+        if st.button(f"📦 Build {title}", key=f'{key}_build'):
+            jobs.submit(job_key, build, stages=stages)
+            st.rerun()
+    elif not job.done():
+        render_report_progress(job, f"Building {title}")
+    elif job.error() is not None:
+        st.error(f"Error building {title}: {job.error()}")
+        if st.button("🔁 Retry", key=f'{key}_retry'):
+            jobs.discard(job_key)
+            st.rerun()
+    else:
+        # The file is read from disk only when the button is clicked
+        st.download_button(
+            label=f"📥 Download {title}",
+            data=job.result().read_bytes,
+            file_name=file_name,
+            mime=mime,
+            key=f'{key}_download'
+        )
@@ -5,12 +5,59 @@ Password protected and separate from Zoho integration
 """
 
 import streamlit as st
-import pandas as pd
-import json
 import io
 from datetime import datetime
+from functools import partial
 import xlsxwriter
 
+from billing_engine import (
+    ALL_GROUPS,
+    aggregate_billing,
+    apply_column_plan,
+    BILLING_GROUP_ORDER,
+    build_account_index,
+    cached_column_plan,
+    compact_usage_frame,
+    consolidate_accounts,
+    ensure_normalized,
+    file_hash,
+    ingest_columns,
+    input_totals,
+    is_normalized,
+    normalize_metrics,
+    read_usage_csv,
+    read_usage_xlsx,
+    reconcile_totals,
+    ReportFile,
+    result_cache,
+    stream_usage_csv,
+    write_consolidated_sheet
+)
+from billing_rules import billing_rules_version, get_billing_rules
+from billing_ui import (
+    render_bulk_assignment,
+    render_diagnostics,
+    render_history_controls,
+    render_job_download,
+    render_report_progress,
+    upload_hash
+)
+from diagnostics import span, start_recording, stop_recording
+from export_bundle import build_export_bundle, build_group_bundle, EXPORT_FORMATS
+from history_store import get_history_store, write_history_sheet
+from mapping_store import get_mapping_store
+from pipeline import apply_assignments, BillingPipeline
+from report_jobs import report_jobs
+from usage_cache import cache_key as usage_cache_key, usage_cache
+
+TEST_DATA_FILE = 'attached_assets/tracking_number_usage_1749645560316.csv'
+
+# Diagnostics spans the background builds record, in order, for the progress bar
+# (the aggregate comes from the pipeline)
+REPORT_STAGES = ('render', 'save', 'integrity')
+EXPORT_STAGES = tuple(f'export_{fmt}' for fmt in EXPORT_FORMATS) + ('zip',)
+SPLIT_STAGES = tuple(f'split:{group}' for group in BILLING_GROUP_ORDER) + ('zip',)
+
 def check_password():
     """Returns `True` if the user had the correct password."""
     def password_entered():
@@ -38,111 +85,137 @@ def check_password():
         # Password correct.
         return True
 
+def mappings_version():
+    """Version counter of the mapping store, used in cache keys"""
+    return get_mapping_store().version()
+
 def load_account_mappings():
-    """Load account to group mappings"""
-    try:
-        with open('account_group_mappings.json', 'r') as f:
-            return json.load(f)
-    except FileNotFoundError:
-        return {}
+    """Load account to group mappings
+
+    The returned dict is shared across reruns until the mappings change; treat it as read-only.
+    """
+    return get_mapping_store().load()
 
 def save_account_mappings(mappings):
     """Save account to group mappings"""
-    with open('account_group_mappings.json', 'w') as f:
-        json.dump(mappings, f, indent=2)
+    get_mapping_store().replace_all(mappings)
+
+def assign_accounts(assignments, pipeline=None):
+    """Save many account to group mappings in one batched write
+
+    With a pipeline, its map and aggregate stages are patched for just these accounts.
+    """
+    previous = mappings_version()
+    get_mapping_store().assign_accounts(assignments)
+    if pipeline is not None:
+        patch_pipeline_mappings(pipeline, assignments, previous)
+
+def assign_account(account, group, pipeline=None):
+    """Save a single account to group mapping"""
+    previous = mappings_version()
+    get_mapping_store().assign_account(account, group)
+    if pipeline is not None:
+        patch_pipeline_mappings(pipeline, {account: group}, previous)
+
+def patch_pipeline_mappings(pipeline, assignments, previous_version):
+    """Move the pipeline to the saved mappings incrementally
+
+    Only when the pipeline was on previous_version and this save was the one
+    write since; otherwise the next run invalidates as usual.
+    """
+    version = mappings_version()
+    if pipeline.version('mappings')[0] == previous_version and version == previous_version + 1:
+        apply_assignments(pipeline, assignments, version, load_account_mappings())
+
+# More comprehensive column mappings with case-insensitive matching
+# Note: We avoid mapping cost columns to quantity columns to prevent duplicates
+COLUMN_MAPPINGS = {
+    # Account variations
+    'account': 'Account Number',
+
+    # Calls variations
+    'calls quantity': 'Calls Total',
+    'call quantity': 'Calls Total', 
+    'calls': 'Calls Total',
+    'call': 'Calls Total',
+    'calls total': 'Calls Total',
+    'call total': 'Calls Total',
+    'total calls': 'Calls Total',
+
+    # Minutes variations (keep existing quantities, don't map cost to quantity)
+    'minutes': 'Minutes quantity',
+    'minute': 'Minutes quantity',
+    'call minutes': 'Minutes quantity',
+    'call minute': 'Minutes quantity',
+
+    # Messages variations (keep existing quantities, don't map cost to quantity)
+    'messages': 'Messages quantity',
+    'message': 'Messages quantity',
+    'sms quantity': 'Messages quantity',
+    'sms': 'Messages quantity',
+    'messages total': 'Messages quantity',
+    'message total': 'Messages quantity',
+
+    # Transcriptions variations
+    'transcription': 'Transcriptions quantity',
+    'transcriptions': 'Transcriptions quantity',
+    'transcription minutes': 'Transcriptions quantity',
+    'transcriptions minutes': 'Transcriptions quantity',
+    'transcription minute': 'Transcriptions quantity',
+    'transcriptions minute': 'Transcriptions quantity',
 
-def validate_csv(df):
-    """Validate CSV structure and standardize column names"""
-    # Show original columns for debugging
+    # AskAI variations
+    'askai': 'AskAI quantity',
+    'ask ai': 'AskAI quantity',
+    'ai quantity': 'AskAI quantity',
+    'ai': 'AskAI quantity',
 
+    # Numbers variations
+    'numbers': 'Numbers quantity',
+    'number': 'Numbers quantity',
+    'phone numbers': 'Numbers quantity',
+    'phone number': 'Numbers quantity'
+}
+
+def resolve_column_plan(columns):
+    """Work out how validate_csv renames and completes a header row
     
+    Returns {'columns', 'defaults', 'missing'}: the final name of every
+    column in order, default values for report columns the file lacks, and
+    required columns that are absent.
+    """
     # Standardize column names
-    if 'Account' in df.columns and 'Account Number' not in df.columns:
-        df = df.rename(columns={'Account': 'Account Number'})
-    
-    # More comprehensive column mappings with case-insensitive matching
-    # Note: We avoid mapping cost columns to quantity columns to prevent duplicates
-    column_mappings = {
-        # Account variations
-        'account': 'Account Number',
-        
-        # Calls variations
-        'calls quantity': 'Calls Total',
-        'call quantity': 'Calls Total', 
-        'calls': 'Calls Total',
-        'call': 'Calls Total',
-        'calls total': 'Calls Total',
-        'call total': 'Calls Total',
-        'total calls': 'Calls Total',
-        
-        # Minutes variations (keep existing quantities, don't map cost to quantity)
-        'minutes': 'Minutes quantity',
-        'minute': 'Minutes quantity',
-        'call minutes': 'Minutes quantity',
-        'call minute': 'Minutes quantity',
-        
-        # Messages variations (keep existing quantities, don't map cost to quantity)
-        'messages': 'Messages quantity',
-        'message': 'Messages quantity',
-        'sms quantity': 'Messages quantity',
-        'sms': 'Messages quantity',
-        'messages total': 'Messages quantity',
-        'message total': 'Messages quantity',
-        
-        # Transcriptions variations
-        'transcription': 'Transcriptions quantity',
-        'transcriptions': 'Transcriptions quantity',
-        'transcription minutes': 'Transcriptions quantity',
-        'transcriptions minutes': 'Transcriptions quantity',
-        'transcription minute': 'Transcriptions quantity',
-        'transcriptions minute': 'Transcriptions quantity',
-        
-        # AskAI variations
-        'askai': 'AskAI quantity',
-        'ask ai': 'AskAI quantity',
-        'ai quantity': 'AskAI quantity',
-        'ai': 'AskAI quantity',
-        
-        # Numbers variations
-        'numbers': 'Numbers quantity',
-        'number': 'Numbers quantity',
-        'phone numbers': 'Numbers quantity',
-        'phone number': 'Numbers quantity'
-    }
+    if 'Account' in columns and 'Account Number' not in columns:
+        columns = ['Account Number' if col == 'Account' else col for col in columns]
     
     # Apply case-insensitive column mappings
-    df_columns_lower = {col.lower(): col for col in df.columns}
+    columns_lower = {col.lower(): col for col in columns}
     rename_dict = {}
     
-    for pattern, target in column_mappings.items():
-        if pattern.lower() in df_columns_lower:
-            original_col = df_columns_lower[pattern.lower()]
+    for pattern, target in COLUMN_MAPPINGS.items():
+        if pattern.lower() in columns_lower:
+            original_col = columns_lower[pattern.lower()]
             # Only rename if target column doesn't already exist
-            if target not in df.columns:
+            if target not in columns:
                 rename_dict[original_col] = target
     
-    if rename_dict:
-        df = df.rename(columns=rename_dict)
+    columns = [rename_dict.get(col, col) for col in columns]
     
     # Handle duplicate column names by making them unique
-    cols = pd.Series(df.columns)
-    for dup in cols[cols.duplicated()].unique():
-        cols[cols[cols == dup].index.values.tolist()] = [dup + '_' + str(i) if i != 0 else dup for i in range(sum(cols == dup))]
-    df.columns = cols
-    
-
-    
-    # Map the actual columns from your CSV to standardized names for processing
-    # Your CSV has: Calls Total, Messages Total, Messages quantity, etc.
-    # We'll use these directly and create aliases for consistent processing
+    seen = {}
+    unique_columns = []
+    for col in columns:
+        unique_columns.append(f"{col}_{seen[col]}" if seen.get(col) else col)
+        seen[col] = seen.get(col, 0) + 1
+    columns = unique_columns
     
     # Create standardized column aliases
     column_aliases = {}
     
     # Use Messages Total if available, otherwise Messages quantity
-    if 'Messages Total' in df.columns:
+    if 'Messages Total' in columns:
         column_aliases['Messages quantity'] = 'Messages Total'
-    elif 'Messages quantity' in df.columns:
+    elif 'Messages quantity' in columns:
         column_aliases['Messages quantity'] = 'Messages quantity'
     
     # Ensure all required columns exist
@@ -156,27 +229,36 @@ def validate_csv(df):
         'Numbers quantity': 0
     }
     
+    defaults = {}
     for col_name, default_value in required_columns_with_defaults.items():
-        if col_name not in df.columns:
+        if col_name not in columns:
             # Check if we have an alias for this column
-            if col_name in column_aliases and column_aliases[col_name] in df.columns:
+            if col_name in column_aliases and column_aliases[col_name] in columns:
                 continue  # Column exists under different name
-            else:
-                df[col_name] = default_value
-                st.warning(f"Added missing column '{col_name}' with default value: {default_value}")
-    
-    # Show a sample of the data to verify
-    st.subheader("Data Preview")
-    st.dataframe(df.head())
-    
-
+            defaults[col_name] = default_value
     
     # Check for required columns
     required_columns = ['Account Number']
-    missing_columns = [col for col in required_columns if col not in df.columns]
+    missing_columns = [col for col in required_columns if col not in columns]
     
-    if missing_columns:
-        st.error(f"Missing required columns: {missing_columns}")
+    return {'columns': columns, 'defaults': defaults, 'missing': missing_columns}
+
+def validate_csv(df, show_messages=True):
+    """Validate CSV structure and standardize column names
+    
+    The column plan is resolved once per header layout and then reused, so
+    repeat uploads in a known export format are only renamed and completed.
+    Columns added with defaults are listed in attrs['added_columns'] for
+    main() to report on every run, since parsed uploads are cached.
+    """
+    plan, _ = cached_column_plan('standalone', df.columns, resolve_column_plan)
+    df = apply_column_plan(df, plan)
+    if plan['defaults']:
+        df.attrs['added_columns'] = dict(plan['defaults'])
+    
+    if plan['missing']:
+        if show_messages:
+            st.error(f"Missing required columns: {plan['missing']}")
         return None
     
     # Convert Account Number to string for consistent mapping
@@ -194,30 +276,36 @@ def get_billing_groups():
         "INDEPENDENTS"
     ]
 
-def identify_new_accounts(df, mappings):
+def identify_new_accounts(df, mappings, account_index=None):
     """Identify accounts that haven't been assigned to groups"""
-    all_accounts = set(df['Account Number'].astype(str).tolist())
-    mapped_accounts = set(mappings.keys())
-    return list(all_accounts - mapped_accounts)
+    if account_index is None:
+        account_index = build_account_index(df)
+    with span('map', rows=len(account_index)):
+        return [account for account in account_index if account not in mappings]
 
-def group_accounts_by_billing_group(df, mappings):
+def group_accounts_by_billing_group(df, mappings, account_index=None):
     """Group accounts based on mappings and return organized data"""
+    if account_index is None:
+        account_index = build_account_index(df)
     grouped_data = {}
     
     for account, group in mappings.items():
-        if account in df['Account Number'].astype(str).values:
+        if account in account_index:
             if group not in grouped_data:
                 grouped_data[group] = []
             
-            account_row = df[df['Account Number'].astype(str) == account].iloc[0]
+            account_row = df.iloc[account_index[account]]
             grouped_data[group].append(account_row)
     
     return grouped_data
 
-def validate_data_integrity(df, mappings, processed_accounts):
+def validate_data_integrity(df, mappings, processed_accounts, account_index=None):
     """Validate that all uploaded data is included in the processed output"""
+    if account_index is None:
+        account_index = build_account_index(df)
+    totals = input_totals(df)
     validation_results = {
-        'total_input_records': len(df),
+        'total_input_records': totals['records'],
         'total_processed_records': len(processed_accounts),
         'missing_accounts': [],
         'unmapped_accounts': [],
@@ -226,100 +314,38 @@ def validate_data_integrity(df, mappings, processed_accounts):
     }
     
     # Check for missing accounts
-    input_accounts = set(df['Account Number'].astype(str).tolist())
     processed_account_set = set(processed_accounts)
-    missing_accounts = input_accounts - processed_account_set
+    missing_accounts = [account for account in account_index if account not in processed_account_set]
     
     if missing_accounts:
-        validation_results['missing_accounts'] = list(missing_accounts)
+        validation_results['missing_accounts'] = missing_accounts
         validation_results['validation_passed'] = False
     
     # Check for unmapped accounts (should be caught earlier but double-check)
-    unmapped = []
-    for account in input_accounts:
-        if account not in mappings:
-            unmapped.append(account)
+    unmapped = [account for account in account_index if account not in mappings]
     
     if unmapped:
         validation_results['unmapped_accounts'] = unmapped
         validation_results['validation_passed'] = False
     
-    # Validate data totals
-    input_calls_total = df['Calls Total'].fillna(0).astype(float).sum()
-    
-    # Use Messages Total if available, otherwise Messages quantity
-    if 'Messages Total' in df.columns:
-        input_messages_total = df['Messages Total'].fillna(0).astype(float).sum()
-    else:
-        input_messages_total = df['Messages quantity'].fillna(0).astype(float).sum()
+    # Reconcile input and processed totals per group and metric
+    reconciliation = reconcile_totals(df, mappings, processed_accounts, account_index)
+    validation_results['reconciliation'] = reconciliation
     
-    # Calculate input transcription total using cost ÷ $0.02 method (same as output)
-    if 'Transcriptions cost' in df.columns:
-        transcription_costs = df['Transcriptions cost'].fillna('$0.00').astype(str).str.replace('$', '').str.replace(',', '').astype(float)
-        input_transcriptions_total = (transcription_costs / 0.02).sum()
-    else:
-        input_transcriptions_total = df['Transcriptions quantity'].fillna(0).astype(float).sum()
-    
-    input_askai_total = df['AskAI quantity'].fillna(0).astype(float).sum()
-    input_numbers_total = df['Numbers quantity'].fillna(0).astype(float).sum()
-    
-    # Calculate processed totals (excluding BBT multiplier for comparison)
-    processed_calls_total = 0
-    processed_messages_total = 0
-    processed_transcriptions_total = 0
-    processed_askai_total = 0
-    processed_numbers_total = 0
-    
-    for account in processed_accounts:
-        account_row = df[df['Account Number'].astype(str) == account]
-        if not account_row.empty:
-            processed_calls_total += account_row['Calls Total'].fillna(0).astype(float).iloc[0]
-            
-            # Use Messages Total if available, otherwise Messages quantity
-            if 'Messages Total' in account_row.columns:
-                processed_messages_total += account_row['Messages Total'].fillna(0).astype(float).iloc[0]
-            else:
-                processed_messages_total += account_row['Messages quantity'].fillna(0).astype(float).iloc[0]
-            
-            # Calculate transcription minutes from cost ÷ $0.02 (same as output)
-            if 'Transcriptions cost' in account_row.columns and not pd.isna(account_row['Transcriptions cost'].iloc[0]):
-                cost_str = str(account_row['Transcriptions cost'].iloc[0]).replace('$', '').replace(',', '')
-                try:
-                    cost = float(cost_str)
-                    processed_transcriptions_total += cost / 0.02
-                except (ValueError, TypeError):
-                    processed_transcriptions_total += account_row['Transcriptions quantity'].fillna(0).astype(float).iloc[0]
-            else:
-                processed_transcriptions_total += account_row['Transcriptions quantity'].fillna(0).astype(float).iloc[0]
-            
-            processed_askai_total += account_row['AskAI quantity'].fillna(0).astype(float).iloc[0]
-            processed_numbers_total += account_row['Numbers quantity'].fillna(0).astype(float).iloc[0]
-    
-    # Check if totals match (allowing for small floating point differences)
-    tolerance = 0.01
-    if (abs(input_calls_total - processed_calls_total) > tolerance or
-        abs(input_messages_total - processed_messages_total) > tolerance or
-        abs(input_transcriptions_total - processed_transcriptions_total) > tolerance or
-        abs(input_askai_total - processed_askai_total) > tolerance or
-        abs(input_numbers_total - processed_numbers_total) > tolerance):
+    overall = reconciliation[reconciliation['Billing Group'] == ALL_GROUPS].set_index('Metric')
+    if not overall['Matches'].all():
         validation_results['data_totals_match'] = False
         validation_results['validation_passed'] = False
     
-    validation_results['input_totals'] = {
-        'calls': input_calls_total,
-        'messages': input_messages_total,
-        'transcriptions': input_transcriptions_total,
-        'askai': input_askai_total,
-        'numbers': input_numbers_total
-    }
-    
-    validation_results['processed_totals'] = {
-        'calls': processed_calls_total,
-        'messages': processed_messages_total,
-        'transcriptions': processed_transcriptions_total,
-        'askai': processed_askai_total,
-        'numbers': processed_numbers_total
+    summary_metrics = {
+        'calls': 'Calls Total',
+        'messages': 'Messages quantity',
+        'transcriptions': 'Transcription Minutes',
+        'askai': 'AskAI quantity',
+        'numbers': 'Numbers quantity'
     }
+    validation_results['input_totals'] = {key: overall.at[metric, 'Input'] for key, metric in summary_metrics.items()}
+    validation_results['processed_totals'] = {key: overall.at[metric, 'Processed'] for key, metric in summary_metrics.items()}
     
     return validation_results
 
@@ -359,7 +385,12 @@ def create_simple_billing_excel(df, mappings):
         worksheet.write(2, col, header, header_format)
     
     # Group accounts by billing group
-    grouped_data = group_accounts_by_billing_group(df, mappings)
+    grouped_data = group_accounts_by_billing_group(ensure_normalized(df), mappings)
+    
+    # Multipliers and standard rates come from the billing rules
+    rules = get_billing_rules()
+    rates = rules['unit_rates']
+    askai_multipliers = rules['multipliers'].get('AskAI quantity', {})
     
     row = 3
     
@@ -370,23 +401,17 @@ def create_simple_billing_excel(df, mappings):
             
         accounts = grouped_data[group_name]
         
-        # Calculate group totals using the correct column names from your CSV
-        group_calls = sum(pd.to_numeric(acc.get('Calls Total', 0), errors='coerce') for acc in accounts)
-        
-        # Use Messages Total if available, otherwise Messages quantity
-        if 'Messages Total' in df.columns:
-            group_messages = sum(pd.to_numeric(acc.get('Messages Total', 0), errors='coerce') for acc in accounts)
-        else:
-            group_messages = sum(pd.to_numeric(acc.get('Messages quantity', 0), errors='coerce') for acc in accounts)
-            
-        group_askai = sum(pd.to_numeric(acc.get('AskAI quantity', 0), errors='coerce') for acc in accounts)
+        # Calculate group totals from the normalized metric columns
+        group_calls = sum(acc['Calls Total'] for acc in accounts)
+        group_messages = sum(acc['Messages quantity'] for acc in accounts)
+        group_askai = sum(acc['AskAI quantity'] for acc in accounts)
         
-        # Apply BBT multiplier rule
-        if group_name == "BIG BRAND TIRE GROUP":
-            group_askai *= 7
+        # Apply group multiplier rule
+        askai_multiplier = askai_multipliers.get(group_name, 1)
+        group_askai *= askai_multiplier
         
         # Calculate total cost (using standard rates)
-        total_cost = (group_calls * 0.05) + (group_messages * 0.02) + (group_askai * 0.10)
+        total_cost = (group_calls * rates['Calls Total']) + (group_messages * rates['Messages quantity']) + (group_askai * rates['AskAI quantity'])
         
         # Write group summary row - 6 columns only
         worksheet.write(row, 0, group_name, group_format)
@@ -401,21 +426,14 @@ def create_simple_billing_excel(df, mappings):
         for account in accounts:
             account_number = str(account['Account Number'])
             account_name = account.get('Account Name', 'Unknown')
-            calls = pd.to_numeric(account.get('Calls Total', 0), errors='coerce')
-            
-            # Use Messages Total if available, otherwise Messages quantity
-            if 'Messages Total' in df.columns:
-                messages = pd.to_numeric(account.get('Messages Total', 0), errors='coerce')
-            else:
-                messages = pd.to_numeric(account.get('Messages quantity', 0), errors='coerce')
-                
-            askai = pd.to_numeric(account.get('AskAI quantity', 0), errors='coerce')
+            calls = account['Calls Total']
+            messages = account['Messages quantity']
+            askai = account['AskAI quantity']
             
-            # Apply BBT multiplier for individual accounts
-            if group_name == "BIG BRAND TIRE GROUP":
-                askai *= 7
+            # Apply group multiplier for individual accounts
+            askai *= askai_multiplier
             
-            cost = (calls * 0.05) + (messages * 0.02) + (askai * 0.10)
+            cost = (calls * rates['Calls Total']) + (messages * rates['Messages quantity']) + (askai * rates['AskAI quantity'])
             
             worksheet.write(row, 0, account_number)
             worksheet.write(row, 1, account_name)
@@ -437,13 +455,14 @@ def create_simple_billing_excel(df, mappings):
     output.seek(0)
     return output.getvalue()
 
-def create_consolidated_billing_excel(df, mappings):
-    """Create consolidated billing Excel file matching 6/2/25 format"""
-    output = io.BytesIO()
-    processed_accounts = []  # Track all accounts processed
-    
-    # Create workbook with xlsxwriter
-    workbook = xlsxwriter.Workbook(output, {'in_memory': True})
+def write_consolidated_billing_workbook(workbook, df, mappings, account_index=None, report_month=None, history_month=None, aggregate=None):
+    """Write consolidated billing Excel sheet matching 6/2/25 format
+
+    report_month is the title month, e.g. 'June 2025'; defaults to the current month.
+    With a history_month ('YYYY-MM') that is in the usage history, a
+    'Month over Month' comparison sheet is added. An aggregate already
+    computed by aggregate_billing is written as is.
+    """
     worksheet = workbook.add_worksheet('Billing Report')
     
     # Define formats
@@ -461,209 +480,233 @@ def create_consolidated_billing_excel(df, mappings):
     
     currency_format = workbook.add_format({'num_format': '$#,##0.00'})
     
-    # Get month for header
-    current_month = datetime.now().strftime('%B %Y')
-    
-    # Write header
-    worksheet.merge_range(0, 0, 0, 7, f'Client Billing Report - {current_month}', header_format)
-    
-    # Calculate global totals for all data first
-    global_calls = df['Calls Total'].fillna(0).astype(float).sum()
-    global_minutes = df['Minutes quantity'].fillna(0).astype(float).sum()
-    
-    # Use Messages Total if available, otherwise Messages quantity
-    if 'Messages Total' in df.columns:
-        global_messages = df['Messages Total'].fillna(0).astype(float).sum()
-    else:
-        global_messages = df['Messages quantity'].fillna(0).astype(float).sum()
-    
-    # Calculate transcription minutes from cost divided by $0.02
-    if 'Transcriptions cost' in df.columns:
-        # Remove $ sign and convert to float, then divide by 0.02 to get minutes
-        transcription_costs = df['Transcriptions cost'].fillna('$0.00').astype(str).str.replace('$', '').str.replace(',', '').astype(float)
-        global_transcription = (transcription_costs / 0.02).sum()
-    else:
-        # Fallback to quantity if cost column not available
-        global_transcription = df['Transcriptions quantity'].fillna(0).astype(float).sum()
-    
-    global_askai = df['AskAI quantity'].fillna(0).astype(float).sum()
-    global_numbers = df['Numbers quantity'].fillna(0).astype(float).sum()
-    
-    # Apply BBT multiplier to global AskAI total
-    bbt_accounts = [acc for acc, group in mappings.items() if group == "BIG BRAND TIRE GROUP" and acc in df['Account Number'].astype(str).values]
-    bbt_askai_adjustment = 0
-    for account in bbt_accounts:
-        account_row = df[df['Account Number'].astype(str) == account]
-        if not account_row.empty:
-            bbt_askai_adjustment += account_row['AskAI quantity'].fillna(0).astype(float).iloc[0] * 6  # 7x - 1x = 6x additional
-    
-    global_askai_with_multiplier = global_askai + bbt_askai_adjustment
-    
-    # Write global summary in line 2
-    worksheet.write(1, 0, 'GLOBAL TOTALS', group_format)
-    worksheet.write(1, 1, f'{len(df)} accounts', group_format)
-    worksheet.write(1, 2, int(global_calls), group_format)
-    worksheet.write(1, 3, int(global_minutes), group_format)
-    worksheet.write(1, 4, int(global_messages), group_format)
-    worksheet.write(1, 5, int(global_transcription), group_format)
-    worksheet.write(1, 6, int(global_askai_with_multiplier), group_format)
-    worksheet.write(1, 7, int(global_numbers), group_format)
-    
-    # Column headers
-    headers = ['Account', 'Account Name', 'Calls Total', 'Minutes quantity', 'Messages quantity', 'Transcription Minutes', 'AskAI quantity', 'Numbers quantity']
-    for col, header in enumerate(headers):
-        worksheet.write(2, col, header, header_format)
-    
-    # Group accounts by billing group
-    grouped_data = {}
-    for account, group in mappings.items():
-        if account in df['Account Number'].astype(str).values:
-            if group not in grouped_data:
-                grouped_data[group] = []
-            
-            account_row = df[df['Account Number'].astype(str) == account].iloc[0]
-            grouped_data[group].append(account_row)
-            processed_accounts.append(account)  # Track processed account
-    
-    row = 3
-    
-    # Process each group
-    for group_name in ["BTTW GROUP", "BIG BRAND TIRE GROUP", "Sylvan Learning", "Truckfitters", "INDEPENDENTS"]:
-        if group_name not in grouped_data:
-            continue
-            
-        accounts = grouped_data[group_name]
-        
-        # Calculate group totals - handle NaN values properly
-        group_calls = sum(pd.to_numeric(acc.get('Calls Total', 0), errors='coerce') or 0 for acc in accounts)
-        group_minutes = sum(pd.to_numeric(acc.get('Minutes quantity', 0), errors='coerce') or 0 for acc in accounts)  
-        
-        # Use Messages Total if available, otherwise Messages quantity
-        group_messages = 0
-        for acc in accounts:
-            if 'Messages Total' in acc and acc.get('Messages Total') is not None:
-                group_messages += pd.to_numeric(acc.get('Messages Total', 0), errors='coerce') or 0
-            else:
-                group_messages += pd.to_numeric(acc.get('Messages quantity', 0), errors='coerce') or 0
-        
-        # Calculate transcription minutes from cost divided by $0.02
-        group_transcription = 0
-        for acc in accounts:
-            if 'Transcriptions cost' in acc and acc.get('Transcriptions cost'):
-                cost_str = str(acc.get('Transcriptions cost', '$0.00')).replace('$', '').replace(',', '')
-                try:
-                    cost = float(cost_str)
-                    group_transcription += cost / 0.02
-                except (ValueError, TypeError):
-                    # Fallback to quantity if cost parsing fails
-                    group_transcription += pd.to_numeric(acc.get('Transcriptions quantity', 0), errors='coerce') or 0
-            else:
-                # Fallback to quantity if cost not available
-                group_transcription += pd.to_numeric(acc.get('Transcriptions quantity', 0), errors='coerce') or 0
-        
-        group_askai = sum(pd.to_numeric(acc.get('AskAI quantity', 0), errors='coerce') or 0 for acc in accounts)
-        group_numbers = sum(pd.to_numeric(acc.get('Numbers quantity', 0), errors='coerce') or 0 for acc in accounts)
-        
-        # Apply BBT multiplier rule
-        if group_name == "BIG BRAND TIRE GROUP":
-            group_askai *= 7
-        
-        # Write group summary row
-        worksheet.write(row, 0, group_name, group_format)
-        worksheet.write(row, 1, f'{len(accounts)} accounts', group_format)
-        worksheet.write(row, 2, int(group_calls), group_format)
-        worksheet.write(row, 3, int(group_minutes), group_format)
-        worksheet.write(row, 4, int(group_messages), group_format)
-        worksheet.write(row, 5, int(group_transcription), group_format)
-        worksheet.write(row, 6, int(group_askai), group_format)
-        worksheet.write(row, 7, int(group_numbers), group_format)
-        row += 1
-        
-        # Sort accounts alphabetically by account name
-        accounts_sorted = sorted(accounts, key=lambda x: x.get('Account Name', 'Unknown').upper())
-        
-        # Write individual account rows
-        for account in accounts_sorted:
-            account_number = str(account['Account Number'])
-            account_name = account.get('Account Name', 'Unknown')
-            calls_total = pd.to_numeric(account.get('Calls Total', 0), errors='coerce') or 0
-            minutes_quantity = pd.to_numeric(account.get('Minutes quantity', 0), errors='coerce') or 0
-            
-            # Use Messages Total if available, otherwise Messages quantity
-            if 'Messages Total' in account and account.get('Messages Total') is not None:
-                messages_quantity = pd.to_numeric(account.get('Messages Total', 0), errors='coerce') or 0
-            else:
-                messages_quantity = pd.to_numeric(account.get('Messages quantity', 0), errors='coerce') or 0
-            
-            # Calculate transcription minutes from cost divided by $0.02
-            if 'Transcriptions cost' in account and account.get('Transcriptions cost'):
-                cost_str = str(account.get('Transcriptions cost', '$0.00')).replace('$', '').replace(',', '')
-                try:
-                    cost = float(cost_str)
-                    transcription_minutes = cost / 0.02
-                except (ValueError, TypeError):
-                    # Fallback to quantity if cost parsing fails
-                    transcription_minutes = pd.to_numeric(account.get('Transcriptions quantity', 0), errors='coerce') or 0
-            else:
-                # Fallback to quantity if cost not available
-                transcription_minutes = pd.to_numeric(account.get('Transcriptions quantity', 0), errors='coerce') or 0
-            
-            askai_quantity = pd.to_numeric(account.get('AskAI quantity', 0), errors='coerce') or 0
-            numbers_quantity = pd.to_numeric(account.get('Numbers quantity', 0), errors='coerce') or 0
-            
-            # Individual accounts show original values (no multiplier)
-            
-            worksheet.write(row, 0, account_number)
-            worksheet.write(row, 1, account_name)
-            worksheet.write(row, 2, int(calls_total) if calls_total > 0 else '')
-            worksheet.write(row, 3, int(minutes_quantity) if minutes_quantity > 0 else '')
-            worksheet.write(row, 4, int(messages_quantity) if messages_quantity > 0 else '')
-            worksheet.write(row, 5, int(transcription_minutes) if transcription_minutes > 0 else '')
-            worksheet.write(row, 6, int(askai_quantity) if askai_quantity > 0 else '')
-            worksheet.write(row, 7, int(numbers_quantity) if numbers_quantity > 0 else '')
-            row += 1
+    # Aggregate per account, per group and globally in one pass
+    if aggregate is None:
+        with span('aggregate', rows=len(df)):
+            aggregate = aggregate_billing(df, mappings, account_index)
+    
+    # Write report
+    if report_month is None:
+        report_month = datetime.now().strftime('%B %Y')
+    with span('render', rows=len(aggregate['accounts'])):
+        write_consolidated_sheet(
+            worksheet,
+            aggregate,
+            f'Client Billing Report - {report_month}',
+            header_format,
+            group_format
+        )
         
-        # Add blank row between groups
-        row += 1
+        if history_month is not None:
+            write_history_sheet(workbook, get_history_store(), history_month, header_format, group_format)
     
-    # Auto-adjust column widths
-    worksheet.set_column(0, 0, 15)  # Account
-    worksheet.set_column(1, 1, 25)  # Account Name
-    worksheet.set_column(2, 7, 15)  # All quantity columns
-    
-    # Freeze the header row (row 3 which contains the column headers)
-    worksheet.freeze_panes(3, 0)
-    
-    workbook.close()
+    return aggregate['processed_accounts']
+
+def create_consolidated_billing_excel(df, mappings, account_index=None):
+    """Create the consolidated billing workbook in memory and return its bytes"""
+    output = io.BytesIO()
+    workbook = xlsxwriter.Workbook(output, {'in_memory': True})
+    processed_accounts = write_consolidated_billing_workbook(workbook, df, mappings, account_index)
+    with span('save'):
+        workbook.close()
     output.seek(0)
     return output.getvalue(), processed_accounts
 
-def main():
-    """Main application function"""
-    # Skip page config when called from main app
-    try:
-        st.set_page_config(
-            page_title="Client Sort & Format - Standalone",
-            page_icon="📊",
-            layout="wide"
-        )
-    except:
-        pass  # Page config already set by main app
+def create_consolidated_billing_file(df, mappings, account_index=None, report_month=None, path=None, history_month=None, aggregate=None):
+    """Create the consolidated billing workbook on disk in constant-memory mode
+
+    Rows are flushed to a temp file as they are written, so memory stays flat
+    regardless of report size. Returns (ReportFile, processed_accounts), or
+    (path, processed_accounts) when an output path is given.
+    """
+    report = path or ReportFile()
+    workbook = xlsxwriter.Workbook(path or report.path, {'constant_memory': True})
+    processed_accounts = write_consolidated_billing_workbook(workbook, df, mappings, account_index, report_month, history_month, aggregate)
+    with span('save'):
+        workbook.close()
+    return report, processed_accounts
+
+def build_report(df, mappings, account_index=None, history_month=None, aggregate=None):
+    """Build the consolidated workbook and its integrity check
+
+    Returns (ReportFile, processed_accounts, validation_results).
+    """
+    report_file, processed_accounts = create_consolidated_billing_file(
+        df, mappings, account_index, history_month=history_month, aggregate=aggregate
+    )
+    with span('integrity', rows=len(df)):
+        validation = validate_data_integrity(df, mappings, processed_accounts, account_index)
+    return report_file, processed_accounts, validation
+
+def build_export(df, mappings, account_index=None, report_month=None, aggregate=None):
+    """ZIP of the billing data as CSV, Parquet, JSON and XLSX, all written from one aggregate
+
+    Returns a ReportFile holding the ZIP.
+    """
+    if aggregate is None:
+        with span('aggregate', rows=len(df)):
+            aggregate = aggregate_billing(df, mappings, account_index)
+    return build_export_bundle(
+        aggregate,
+        lambda path: create_consolidated_billing_file(df, mappings, account_index, report_month, path=path, aggregate=aggregate)
+    )
+
+def write_group_workbook(path, group_name, aggregate, report_month=None):
+    """Write one billing group's workbook: its summary row and sorted accounts, no global totals"""
+    workbook = xlsxwriter.Workbook(path, {'constant_memory': True})
+    worksheet = workbook.add_worksheet('Billing Report')
     
-    # Skip password check when called from main app (already authenticated)
-    # Check if already authenticated via main app or standalone
-    if "password_correct" not in st.session_state or not st.session_state.get("password_correct", False):
-        try:
-            # Check for saved auth token
-            with open(".auth_token", "r") as f:
-                st.session_state["password_correct"] = True
-        except:
-            # Only show password screen if not authenticated
-            if not check_password():
-                st.markdown("### 🔒 Client Sort & Format Tool")
-                st.markdown("Secure access required for billing data processing")
-                return
+    # Define formats
+    header_format = workbook.add_format({
+        'bold': True,
+        'font_size': 12,
+        'align': 'center'
+    })
+    
+    group_format = workbook.add_format({
+        'bold': True,
+        'font_size': 11,
+        'bg_color': '#E6E6FA'
+    })
     
+    if report_month is None:
+        report_month = datetime.now().strftime('%B %Y')
+    write_consolidated_sheet(
+        worksheet,
+        aggregate,
+        f'{group_name} Billing Report - {report_month}',
+        header_format,
+        group_format,
+        global_row=False
+    )
+    workbook.close()
+
+def build_group_split(df, mappings, account_index=None, report_month=None, aggregate=None):
+    """ZIP with one workbook per billing group, all written concurrently from one aggregate
+
+    Returns a ReportFile holding the ZIP.
+    """
+    if aggregate is None:
+        with span('aggregate', rows=len(df)):
+            aggregate = aggregate_billing(df, mappings, account_index)
+    return build_group_bundle(aggregate, partial(write_group_workbook, report_month=report_month))
+
+def ingest_upload(source):
+    """Read an upload's rows (pipeline ingest stage)
+
+    source is the pipeline's source dict with name, stream and either
+    file (the UploadedFile, read in place rather than copied) or path (the
+    test data file). Only columns the validator recognizes are parsed; in large file
+    mode CSVs are streamed into an already validated and normalized account
+    summary, or None if validation fails.
+    """
+    if source.get('file') is not None:
+        upload = source['file']
+        upload.seek(0)
+    else:
+        with open(source['path'], 'rb') as f:
+            upload = io.BytesIO(f.read())
+    
+    if source['name'].endswith('.csv') and source['stream']:
+        # Stream in chunks, keeping one row per account plus running totals
+        with span('read_stream') as record:
+            df = stream_usage_csv(upload, validate_csv, column_mappings=COLUMN_MAPPINGS)
+            record['rows'] = None if df is None else input_totals(df)['records']
+        return df
+    
+    with span('read') as record:
+        if source['name'].endswith('.csv'):
+            # Parse only the columns the validator recognizes, with explicit dtypes
+            df = read_usage_csv(upload, COLUMN_MAPPINGS)
+        else:
+            # Stream the sheet, keeping only columns the validator recognizes
+            df = read_usage_xlsx(upload, ingest_columns(COLUMN_MAPPINGS))
+        record['rows'] = len(df)
+    return df
+
+def normalize_upload(pipeline):
+    """Validate, normalize, consolidate and compact the ingested rows (pipeline normalize stage)
+
+    Uploads parsed before are loaded from the Parquet usage cache without
+    running ingest. Otherwise the ingest result is released once the
+    compact frame is built. Returns (df, account_index), or None if
+    validation fails.
+    """
+    data_version, _, stream_large_file = pipeline.version('source')[0]
+    cache_key = usage_cache_key('standalone', data_version, summary=stream_large_file)
+    with span('read_cache') as record:
+        df = usage_cache.load(cache_key)
+        record['rows'] = None if df is None else len(df)
+    
+    if df is None:
+        df = pipeline.get('ingest')
+        pipeline.release('ingest')
+        if df is not None and not is_normalized(df):
+            with span('validate', rows=len(df)):
+                df = validate_csv(df)
+            if df is not None:
+                # Convert metric columns to typed numbers once for all downstream steps
+                with span('normalize', rows=len(df)):
+                    df = normalize_metrics(df)
+                # One row per account, summing accounts listed on several rows
+                with span('consolidate', rows=len(df)):
+                    df = consolidate_accounts(df)
+        if df is None:
+            return None
+        
+        # Smallest lossless dtypes before the frame is cached and kept in the session
+        with span('compact', rows=len(df)):
+            df = compact_usage_frame(df)
+        with span('cache_store', rows=len(df)):
+            usage_cache.store(cache_key, df)
+    
+    with span('index', rows=len(df)):
+        return df, build_account_index(df)
+
+def map_accounts(pipeline):
+    """Accounts without a billing group (pipeline map stage)"""
+    df, account_index = pipeline.get('normalize')
+    return result_cache.get_or_compute(
+        ('standalone', 'new_accounts') + pipeline.version('source', 'mappings'),
+        lambda: identify_new_accounts(df, pipeline.input('mappings'), account_index)
+    )
+
+def aggregate_usage(pipeline):
+    """Account, group and global totals for the current mappings (pipeline aggregate stage)"""
+    df, account_index = pipeline.get('normalize')
+    with span('aggregate', rows=len(df)):
+        return aggregate_billing(df, pipeline.input('mappings'), account_index)
+
+def render_report(pipeline):
+    """Start (or reuse) the background build of the consolidated report (pipeline render stage)
+
+    Returns the ReportJob; its result is (ReportFile, processed_accounts, validation_results).
+    """
+    df, account_index = pipeline.get('normalize')
+    return report_jobs.submit(
+        ('standalone', 'report') + pipeline.version('source', 'mappings', 'rules', 'report'),
+        partial(
+            build_report, df, pipeline.input('mappings'), account_index,
+            pipeline.input('report')['history_month'], pipeline.get('aggregate')
+        ),
+        stages=REPORT_STAGES
+    )
+
+def create_pipeline():
+    """Billing pipeline for one session, sharing parses and new-account lists across sessions"""
+    return BillingPipeline({
+        'ingest': lambda pipeline: ingest_upload(pipeline.input('source')),
+        'normalize': lambda pipeline: result_cache.get_or_compute(
+            ('standalone', 'parse') + pipeline.version('source', 'rules'),
+            partial(normalize_upload, pipeline)
+        ),
+        'map': map_accounts,
+        'aggregate': aggregate_usage,
+        'render': render_report
+    })
+
+def render_sort_page(diagnostics):
+    """Upload, account mapping and report sections of the standalone tool"""
     st.title("📊 Client Sort & Format Tool")
     st.markdown("**Standalone Monthly Billing Data Processor**")
     st.markdown("---")
@@ -679,37 +722,72 @@ def main():
             type=['csv', 'xlsx'],
             help="Upload your monthly tracking number usage file"
         )
+        stream_large_file = st.checkbox(
+            "Large file mode",
+            value=False,
+            help="Stream CSV uploads in chunks and keep only per-account totals in memory"
+        )
+    
+    # One lazily computed pipeline per session; stages are recomputed only when their inputs change
+    if 'pipeline' not in st.session_state:
+        st.session_state['pipeline'] = create_pipeline()
+    pipeline = st.session_state['pipeline']
+    pipeline.set_input('rules', billing_rules_version())
+    pipeline.set_input('mappings', mappings_version(), load_account_mappings())
     
     with col2:
         if st.button("📋 Load Test Data"):
             try:
-                df = pd.read_csv('attached_assets/tracking_number_usage_1749645560316.csv')
-                st.session_state['billing_data'] = df
-                st.success(f"Test data loaded: {len(df)} accounts")
-                st.rerun()
+                pipeline.set_input(
+                    'source',
+                    (file_hash(TEST_DATA_FILE), TEST_DATA_FILE, False),
+                    {'name': TEST_DATA_FILE, 'path': TEST_DATA_FILE, 'stream': False}
+                )
+                parsed = pipeline.get('normalize')
+                if parsed is not None:
+                    st.success(f"Test data loaded: {len(parsed[0])} accounts")
+                    st.rerun()
             except FileNotFoundError:
                 st.error("Test data file not found")
     
     # Process uploaded file
     if uploaded_file:
+        # A new upload invalidates every pipeline stage; reruns reuse them.
+        # The pipeline reads the UploadedFile itself, so no second copy of the bytes is kept.
+        pipeline.set_input(
+            'source',
+            (upload_hash(uploaded_file), uploaded_file.name, stream_large_file),
+            {'name': uploaded_file.name, 'file': uploaded_file, 'stream': stream_large_file}
+        )
+    
+    parsed = None
+    if pipeline.has_input('source'):
         try:
-            if uploaded_file.name.endswith('.csv'):
-                df = pd.read_csv(uploaded_file)
-            else:
-                df = pd.read_excel(uploaded_file)
-            
-            df = validate_csv(df)
-            if df is not None:
-                st.session_state['billing_data'] = df
-                st.success(f"File uploaded: {len(df)} records processed")
+            parsed = pipeline.get('normalize')
+            if parsed is not None and uploaded_file:
+                df = parsed[0]
+                st.success(f"File uploaded: {input_totals(df)['records']} records processed")
+                if 'memory_bytes' in df.attrs:
+                    before, after = df.attrs['memory_bytes']
+                    st.caption(f"In-memory size: {before / 1048576:,.1f} MB → {after / 1048576:,.1f} MB with compact types")
+                if df.attrs.get('merged_rows'):
+                    st.info(f"Merged {df.attrs['merged_rows']:,} duplicate account rows; each account's metrics are summed into one row")
+                for col_name, default_value in df.attrs.get('added_columns', {}).items():
+                    st.warning(f"Added missing column '{col_name}' with default value: {default_value}")
+                
+                # Show a sample of the data to verify
+                st.subheader("Data Preview")
+                st.dataframe(df.head())
+            elif parsed is None:
+                st.error("File validation failed. Please check the file format.")
         except Exception as e:
             st.error(f"Error processing file: {str(e)}")
     
     # Main processing
-    if 'billing_data' in st.session_state:
-        df = st.session_state['billing_data']
-        mappings = load_account_mappings()
-        new_accounts = identify_new_accounts(df, mappings)
+    if parsed is not None:
+        df, account_index = parsed
+        mappings = pipeline.input('mappings')
+        new_accounts = pipeline.get('map')
         
         # Download section - moved to top
         st.header("2. Download Consolidated Report")
@@ -717,24 +795,59 @@ def main():
         if new_accounts:
             st.warning("⚠️ Complete account assignment before downloading")
         else:
-            # Simple download - working version from format app
-            st.success("✅ Data validation passed - All records accounted for")
-            
-
-            
-            # Download button - using working approach
-            col1, col2 = st.columns([1, 1])
-            with col1:
-                excel_data, processed_accounts = create_consolidated_billing_excel(df, mappings)
-                st.download_button(
-                    label="📥 Download Consolidated Billing Report",
-                    data=excel_data,
-                    file_name=f"consolidated_billing_{datetime.now().strftime('%Y-%m-%d')}.xlsx",
-                    mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+            # Keep this month's per-account usage for month-over-month comparisons
+            history = get_history_store()
+            with st.expander("📈 Usage history"):
+                history_month = render_history_controls(
+                    history,
+                    lambda: pipeline.get('aggregate')['accounts']
                 )
             
-            with col2:
-                pass
+            # The workbook is built in the background and rebuilt only when the
+            # data, mappings, history or report month change
+            pipeline.set_input(
+                'report',
+                (history.version(), history_month, datetime.now().strftime('%B %Y')),
+                {'history_month': history_month}
+            )
+            report_job = pipeline.get('render')
+            
+            if not report_job.done():
+                render_report_progress(report_job)
+            elif report_job.error() is not None:
+                st.error(f"Error building report: {report_job.error()}")
+                if st.button("🔁 Retry report"):
+                    report_jobs.discard(report_job.key)
+                    pipeline.invalidate('render')
+                    st.rerun()
+            else:
+                report_file, processed_accounts, validation = report_job.result()
+                
+                if validation['validation_passed']:
+                    st.success("✅ Data validation passed - All records accounted for")
+                else:
+                    st.warning("⚠️ Report totals do not reconcile with the uploaded data")
+                    with st.expander("Reconciliation details"):
+                        reconciliation = validation['reconciliation']
+                        st.dataframe(reconciliation[~reconciliation['Matches']], use_container_width=True)
+                        if validation['missing_accounts']:
+                            st.write(f"**Missing accounts:** {', '.join(validation['missing_accounts'])}")
+                        if validation['unmapped_accounts']:
+                            st.write(f"**Unmapped accounts:** {', '.join(validation['unmapped_accounts'])}")
+                
+                # Download button - using working approach
+                col1, col2 = st.columns([1, 1])
+                with col1:
+                    # The workbook is read from disk only when the button is clicked
+                    st.download_button(
+                        label="📥 Download Consolidated Billing Report",
+                        data=report_file.read_bytes,
+                        file_name=f"consolidated_billing_{datetime.now().strftime('%Y-%m-%d')}.xlsx",
+                        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+                    )
+                
+                with col2:
+                    pass
         
         st.markdown("---")
         
@@ -747,36 +860,47 @@ def main():
             groups = get_billing_groups()
             assignments_made = False
             
-            # Show assignment interface
-            for i, account in enumerate(new_accounts[:5]):  # Show max 5 at a time
-                account_row = df[df['Account Number'].astype(str) == account]
-                if not account_row.empty and 'Account Name' in df.columns:
-                    account_display = f"{account} - {account_row['Account Name'].iloc[0]}"
-                else:
-                    account_display = account
-                
-                col1, col2, col3 = st.columns([3, 2, 1])
-                
-                with col1:
-                    st.write(f"**{account_display}**")
-                
-                with col2:
-                    selected_group = st.selectbox(
-                        "Assign to group:",
-                        ["Select group..."] + groups,
-                        key=f"assign_{account}_{i}"
-                    )
-                
-                with col3:
-                    if st.button("Assign", key=f"btn_{account}_{i}"):
-                        if selected_group != "Select group...":
-                            mappings[account] = selected_group
-                            save_account_mappings(mappings)
-                            assignments_made = True
-                            st.success(f"Assigned to {selected_group}")
+            bulk_mode = st.checkbox(
+                "Bulk assignment mode",
+                value=False,
+                help="Assign all unmapped accounts from one table and save them in a single write"
+            )
             
-            if len(new_accounts) > 5:
-                st.info(f"Showing first 5. {len(new_accounts) - 5} more need assignment.")
+            if bulk_mode:
+                assignments = render_bulk_assignment(df, new_accounts, account_index, groups)
+                if assignments:
+                    assign_accounts(assignments, pipeline)
+                    assignments_made = True
+                    st.success(f"Assigned {len(assignments)} accounts")
+            else:
+                # Show assignment interface
+                for i, account in enumerate(new_accounts[:5]):  # Show max 5 at a time
+                    if 'Account Name' in df.columns:
+                        account_display = f"{account} - {df['Account Name'].iat[account_index[account]]}"
+                    else:
+                        account_display = account
+                    
+                    col1, col2, col3 = st.columns([3, 2, 1])
+                    
+                    with col1:
+                        st.write(f"**{account_display}**")
+                    
+                    with col2:
+                        selected_group = st.selectbox(
+                            "Assign to group:",
+                            ["Select group..."] + groups,
+                            key=f"assign_{account}_{i}"
+                        )
+                    
+                    with col3:
+                        if st.button("Assign", key=f"btn_{account}_{i}"):
+                            if selected_group != "Select group...":
+                                assign_account(account, selected_group, pipeline)
+                                assignments_made = True
+                                st.success(f"Assigned to {selected_group}")
+                
+                if len(new_accounts) > 5:
+                    st.info(f"Showing first 5. {len(new_accounts) - 5} more need assignment.")
             
             if assignments_made:
                 st.rerun()
@@ -786,25 +910,14 @@ def main():
         # Data preview
         st.header("4. Grouped Data Preview")
         
-        # Group data for preview
-        grouped_data = {}
-        for account, group in mappings.items():
-            if account in df['Account Number'].astype(str).values:
-                if group not in grouped_data:
-                    grouped_data[group] = []
-                account_row = df[df['Account Number'].astype(str) == account].iloc[0]
-                grouped_data[group].append(account_row)
+        # Group counts come from the memoized aggregate
+        group_counts = pipeline.get('aggregate')['groups']['accounts']
         
-        if grouped_data:
-            # Summary metrics
-            total_accounts = sum(len(accounts) for accounts in grouped_data.values())
-            
-
-            
+        if len(group_counts):
             # Show brief group summary
             st.write("**Account Groups:**")
-            for group_name, accounts in grouped_data.items():
-                st.write(f"• {group_name}: {len(accounts)} accounts")
+            for group_name, count in group_counts.items():
+                st.write(f"• {group_name}: {count} accounts")
         
         # Export section
         st.header("5. Additional Downloads")
@@ -812,30 +925,90 @@ def main():
         if new_accounts:
             st.info("Complete account assignment to enable additional downloads")
         else:
+            # Export bundles are built in the background on request
             st.info("✅ Ready for additional export options if needed")
+            export_version = pipeline.version('source', 'mappings', 'rules') + (datetime.now().strftime('%B %Y'),)
+            aggregate = pipeline.get('aggregate')
+            render_job_download(
+                report_jobs,
+                ('standalone', 'export') + export_version,
+                partial(build_export, df, mappings, account_index, aggregate=aggregate),
+                EXPORT_STAGES,
+                "export bundle (CSV, Parquet, JSON, XLSX)",
+                f"billing_export_{datetime.now().strftime('%Y-%m-%d')}.zip",
+                "application/zip",
+                key='export'
+            )
+            render_job_download(
+                report_jobs,
+                ('standalone', 'split') + export_version,
+                partial(build_group_split, df, mappings, account_index, aggregate=aggregate),
+                SPLIT_STAGES,
+                "workbooks split by group (ZIP)",
+                f"billing_by_group_{datetime.now().strftime('%Y-%m-%d')}.zip",
+                "application/zip",
+                key='split'
+            )
         
         # Reset section
         st.header("6. Reset")
         if st.button("🔄 Clear Data"):
-            if 'billing_data' in st.session_state:
-                del st.session_state['billing_data']
+            pipeline.clear()
             st.success("Data cleared")
             st.rerun()
     else:
         st.info("👆 Upload your monthly tracking_number_usage.csv file to begin")
         
         # Show current mappings summary
-        mappings = load_account_mappings()
-        if mappings:
+        groups = get_mapping_store().group_counts()
+        if groups:
             st.subheader("Current Account Mappings")
-            groups = {}
-            for account, group in mappings.items():
-                if group not in groups:
-                    groups[group] = 0
-                groups[group] += 1
-            
             for group, count in groups.items():
                 st.write(f"• **{group}**: {count} accounts")
+            
+            st.download_button(
+                label="📤 Export Account Mappings (JSON)",
+                data=get_mapping_store().export_json(),
+                file_name="account_group_mappings.json",
+                mime="application/json"
+            )
+    
+    # Pipeline diagnostics
+    render_diagnostics(diagnostics)
+
+def main():
+    """Main application function"""
+    # Skip page config when called from main app
+    try:
+        st.set_page_config(
+            page_title="Client Sort & Format - Standalone",
+            page_icon="📊",
+            layout="wide"
+        )
+    except:
+        pass  # Page config already set by main app
+    
+    # Skip password check when called from main app (already authenticated)
+    # Check if already authenticated via main app or standalone
+    if "password_correct" not in st.session_state or not st.session_state.get("password_correct", False):
+        try:
+            # Check for saved auth token
+            with open(".auth_token", "r") as f:
+                st.session_state["password_correct"] = True
+        except:
+            # Only show password screen if not authenticated
+            if not check_password():
+                st.markdown("### 🔒 Client Sort & Format Tool")
+                st.markdown("Secure access required for billing data processing")
+                return
+    
+    # Record per-stage timings for the Diagnostics section; the recorder is
+    # stopped even when st.stop() ends the run early
+    diagnostics = start_recording(st.session_state.get('diagnostics_trace_memory', False))
+    try:
+        render_sort_page(diagnostics)
+    finally:
+        stop_recording()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,132 @@
+"""
+Pipeline Diagnostics
+Per-stage instrumentation spans recording wall time, rows processed and peak memory
+"""
+
+import json
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime
+
+try:
+    import resource
+except ImportError:  # not available on Windows; process peak RSS is then omitted
+    resource = None
+
+_local = threading.local()
+
+class PipelineDiagnostics:
+    """Spans recorded during one script run
+
+    Each span is a dict with stage, seconds, rows, peak_mb (None unless
+    memory tracing is on) and started. With trace_memory, tracemalloc runs
+    while the recorder is active and each span reports the peak Python
+    allocation above what was live when it started; nested spans are
+    accounted so an outer stage's peak includes its children. Spans recorded
+    from helper threads (see recording_to) report time and rows only.
+    """
+
+    def __init__(self, trace_memory=False):
+        self.trace_memory = trace_memory
+        self.spans = []
+        self._stack = []
+        self._started_tracing = False
+        self._thread = threading.get_ident()
+
+    def start(self):
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracing = True
+
+    def stop(self):
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+
+    @contextmanager
+    def span(self, stage, rows=None):
+        record = {'stage': stage, 'seconds': None, 'rows': rows, 'peak_mb': None, 'started': datetime.now().isoformat(timespec='seconds')}
+        tracing = self.trace_memory and tracemalloc.is_tracing() and threading.get_ident() == self._thread
+        if tracing:
+            current, peak = tracemalloc.get_traced_memory()
+            if self._stack:
+                self._stack[-1]['peak'] = max(self._stack[-1]['peak'], peak)
+            tracemalloc.reset_peak()
+            self._stack.append({'baseline': current, 'peak': current})
+
+        started = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record['seconds'] = round(time.perf_counter() - started, 4)
+            if tracing:
+                frame = self._stack.pop()
+                peak = max(frame['peak'], tracemalloc.get_traced_memory()[1])
+                if self._stack:
+                    self._stack[-1]['peak'] = max(self._stack[-1]['peak'], peak)
+                record['peak_mb'] = round((peak - frame['baseline']) / (1024 * 1024), 2)
+            self.spans.append(record)
+
+def process_peak_rss_mb():
+    """Peak resident set size of this process in MB, or None if unknown"""
+    if resource is None:
+        return None
+    # ru_maxrss is in kilobytes on Linux
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+def start_recording(trace_memory=False):
+    """Make a new recorder the active one for this thread and return it"""
+    stop_recording()
+    recorder = PipelineDiagnostics(trace_memory)
+    recorder.start()
+    _local.recorder = recorder
+    return recorder
+
+def stop_recording():
+    """Deactivate this thread's recorder, returning it (or None)"""
+    recorder = getattr(_local, 'recorder', None)
+    if recorder is not None:
+        recorder.stop()
+        _local.recorder = None
+    return recorder
+
+def active_recorder():
+    """This thread's active recorder, or None"""
+    return getattr(_local, 'recorder', None)
+
+@contextmanager
+def recording_to(recorder):
+    """Record spans on this thread to recorder for the duration of the block
+
+    Lets pool threads doing part of a recorded task add their stages to the
+    task's recorder. A None recorder leaves recording off.
+    """
+    previous = getattr(_local, 'recorder', None)
+    _local.recorder = recorder
+    try:
+        yield recorder
+    finally:
+        _local.recorder = previous
+
+@contextmanager
+def span(stage, rows=None):
+    """Record a stage on the active recorder; a no-op when nothing is recording
+
+    Yields the span dict, so rows can be filled in once they are known.
+    """
+    recorder = getattr(_local, 'recorder', None)
+    if recorder is None:
+        yield {}
+        return
+    with recorder.span(stage, rows) as record:
+        yield record
+
+def diagnostics_json(spans):
+    """JSON document for a list of spans, for download or monitoring"""
+    return json.dumps({
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'process_peak_rss_mb': process_peak_rss_mb(),
+        'spans': spans
+    }, indent=2)
@@ -0,0 +1,157 @@
+"""
+Export Bundle
+Machine-readable copies of one billing aggregate (CSV, Parquet, JSON) plus
+the consolidated workbook, or one workbook per billing group, written in
+parallel and packaged as one ZIP
+"""
+
+import os
+import re
+import shutil
+import tempfile
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+import pandas as pd
+
+try:
+    import pyarrow  # noqa: F401 - pandas' Parquet engine
+except ImportError:  # optional; bundles are then built without Parquet files
+    pyarrow = None
+
+from billing_engine import METRIC_COLUMNS, ReportFile, split_aggregate
+from diagnostics import active_recorder, recording_to, span
+
+EXPORT_FORMATS = ('csv', 'parquet', 'json', 'xlsx')
+
+# Parquet and XLSX files are already compressed, so they are stored in the ZIP as is
+_STORED_EXTENSIONS = ('.parquet', '.xlsx')
+
+def export_tables(aggregate):
+    """Accounts, groups and totals frames for an aggregate_billing result
+
+    Account rows carry raw metrics; group and global totals include the
+    rules' group multipliers, matching the consolidated report.
+    """
+    groups = aggregate['groups'].rename(columns={'accounts': 'Accounts'}).reset_index()
+    totals = aggregate['global_totals']
+    return {
+        'accounts': aggregate['accounts'],
+        'groups': groups,
+        'totals': pd.DataFrame([{'Records': totals['records'], **{column: totals[column] for column in METRIC_COLUMNS}}])
+    }
+
+def write_csv_files(tables, directory):
+    paths = []
+    for name, table in tables.items():
+        paths.append(os.path.join(directory, f'{name}.csv'))
+        table.to_csv(paths[-1], index=False)
+    return paths
+
+def write_parquet_files(tables, directory):
+    paths = []
+    for name, table in tables.items():
+        paths.append(os.path.join(directory, f'{name}.parquet'))
+        table.to_parquet(paths[-1], index=False)
+    return paths
+
+def write_json_file(tables, directory):
+    """One billing.json document with global_totals, groups and accounts
+
+    Each table is serialized by pandas' C JSON writer and the pieces are
+    joined, rather than building Python dicts for every account.
+    """
+    path = os.path.join(directory, 'billing.json')
+    with open(path, 'w') as f:
+        f.write('{"global_totals": ')
+        f.write(tables['totals'].to_json(orient='records')[1:-1])
+        f.write(', "groups": ')
+        f.write(tables['groups'].to_json(orient='records'))
+        f.write(', "accounts": ')
+        f.write(tables['accounts'].to_json(orient='records'))
+        f.write('}')
+    return [path]
+
+EXPORT_WRITERS = {
+    'csv': write_csv_files,
+    'parquet': write_parquet_files,
+    'json': write_json_file
+}
+
+def _write_concurrently(tasks):
+    """Run (stage, write) tasks on a thread pool; each write returns the paths it wrote
+
+    Each task is recorded as a span on the caller's diagnostics recorder.
+    Returns every written path, in task order.
+    """
+    recorder = active_recorder()
+
+    def run(task):
+        stage, write = task
+        with recording_to(recorder), span(stage):
+            return write()
+
+    with ThreadPoolExecutor(max_workers=len(tasks) or 1, thread_name_prefix='billing-export') as pool:
+        return [path for written in pool.map(run, tasks) for path in written]
+
+def _zip_files(paths, folder):
+    """ZIP the files under folder/ and return the ReportFile holding it"""
+    bundle = ReportFile(suffix='.zip')
+    with span('zip'), zipfile.ZipFile(bundle.path, 'w') as archive:
+        for path in paths:
+            compression = zipfile.ZIP_STORED if path.endswith(_STORED_EXTENSIONS) else zipfile.ZIP_DEFLATED
+            archive.write(path, f'{folder}/{os.path.basename(path)}', compress_type=compression)
+    return bundle
+
+def build_export_bundle(aggregate, write_workbook=None, formats=EXPORT_FORMATS, folder='billing_export'):
+    """Write the aggregate in each format concurrently and zip the results
+
+    write_workbook(path) writes the XLSX member; 'xlsx' is skipped without
+    it, as is 'parquet' without pyarrow. Each format is recorded as an
+    export_<format> span. Returns a ReportFile holding the ZIP, with every
+    member under folder/.
+    """
+    tables = export_tables(aggregate)
+    directory = tempfile.mkdtemp(prefix='billing_export_')
+
+    def write_xlsx():
+        path = os.path.join(directory, 'consolidated_billing.xlsx')
+        write_workbook(path)
+        return [path]
+
+    tasks = [
+        (f'export_{fmt}', partial(EXPORT_WRITERS[fmt], tables, directory))
+        for fmt in formats
+        if fmt in EXPORT_WRITERS and not (fmt == 'parquet' and pyarrow is None)
+    ]
+    if 'xlsx' in formats and write_workbook is not None:
+        tasks.append(('export_xlsx', write_xlsx))
+    try:
+        return _zip_files(_write_concurrently(tasks), folder)
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+def group_file_name(group_name):
+    """File-system safe workbook name for a billing group, e.g. 'BIG_BRAND_TIRE_GROUP.xlsx'"""
+    return re.sub(r'[^A-Za-z0-9]+', '_', group_name).strip('_') + '.xlsx'
+
+def build_group_bundle(aggregate, write_group_workbook, folder='billing_by_group'):
+    """One workbook per billing group, written concurrently from one aggregate and zipped
+
+    write_group_workbook(path, group_name, group_aggregate) writes a single
+    group's workbook; the parts come from split_aggregate. Each group is
+    recorded as a 'split:<group>' span. Returns a ReportFile holding the ZIP.
+    """
+    directory = tempfile.mkdtemp(prefix='billing_split_')
+
+    def write(group_name, part):
+        path = os.path.join(directory, group_file_name(group_name))
+        write_group_workbook(path, group_name, part)
+        return [path]
+
+    tasks = [(f'split:{group_name}', partial(write, group_name, part)) for group_name, part in split_aggregate(aggregate).items()]
+    try:
+        return _zip_files(_write_concurrently(tasks), folder)
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
@@ -0,0 +1,222 @@
+"""
+Usage History Store
+Per-account monthly metrics kept across uploads in SQLite, with
+month-over-month and trailing-12-month comparisons of billed group totals
+"""
+
+import os
+import sqlite3
+import threading
+
+import pandas as pd
+
+from billing_engine import BILLING_GROUP_ORDER, METRIC_COLUMNS
+from billing_rules import get_billing_rules
+
+HISTORY_DB = 'usage_history.db'
+
+# Months are stored as 'YYYY-MM' so string order is chronological
+MONTH_FORMAT = '%Y-%m'
+
+_metric_columns_sql = ', '.join(f'"{column}" REAL NOT NULL' for column in METRIC_COLUMNS)
+_metric_sums_sql = ', '.join(f'SUM("{column}")' for column in METRIC_COLUMNS)
+
+def month_key(period):
+    """'YYYY-MM' key for a date, Timestamp, Period or month string"""
+    return pd.Period(period, freq='M').strftime(MONTH_FORMAT)
+
+class HistoryStore:
+    """Append-only monthly usage partitioned by month
+
+    Rows are clustered on (month, account), so each month is a contiguous
+    partition that is written once and read with a range scan; a second
+    index on (month, billing_group) serves the per-group totals that every
+    comparison starts from. A month is only rewritten when the caller asks
+    to replace it, and then as a whole partition.
+    """
+
+    def __init__(self, db_path=HISTORY_DB):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        with self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS usage_history ("
+                "month TEXT NOT NULL, "
+                "account TEXT NOT NULL, "
+                "account_name TEXT, "
+                "billing_group TEXT NOT NULL, "
+                f"{_metric_columns_sql}, "
+                "PRIMARY KEY (month, account)"
+                ") WITHOUT ROWID"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_history_month_group ON usage_history (month, billing_group)")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+            self._conn.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('version', 0)")
+
+    def version(self):
+        """Current history version, changes whenever a month is recorded"""
+        with self._lock:
+            return self._conn.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()[0]
+
+    def months(self):
+        """Recorded months, oldest first"""
+        with self._lock:
+            rows = self._conn.execute("SELECT DISTINCT month FROM usage_history ORDER BY month")
+            return [row[0] for row in rows.fetchall()]
+
+    def record_month(self, month, accounts, replace=False):
+        """Store one month of per-account metrics
+
+        accounts is the 'accounts' frame from aggregate_billing. Raises
+        ValueError if the month is already recorded, unless replace is set.
+        """
+        month = month_key(month)
+        rows = pd.DataFrame({
+            'month': month,
+            'account': accounts['Account Number'].astype(str),
+            'account_name': accounts['Account Name'].astype(str),
+            'billing_group': accounts['Billing Group']
+        })
+        rows = pd.concat([rows, accounts[METRIC_COLUMNS].astype(float)], axis=1)
+        placeholders = ', '.join('?' * len(rows.columns))
+
+        with self._lock, self._conn:
+            exists = self._conn.execute("SELECT 1 FROM usage_history WHERE month = ? LIMIT 1", (month,)).fetchone()
+            if exists and not replace:
+                raise ValueError(f"{month} is already in the usage history")
+            self._conn.execute("DELETE FROM usage_history WHERE month = ?", (month,))
+            self._conn.executemany(
+                f"INSERT INTO usage_history VALUES ({placeholders})",
+                rows.itertuples(index=False, name=None)
+            )
+            self._conn.execute("UPDATE meta SET value = value + 1 WHERE key = 'version'")
+
+    def group_totals(self, first_month, last_month, rules=None):
+        """Per-group account counts and billed metric totals for each month in the range
+
+        Accounts are stored with raw metrics; the rules' group multipliers
+        are applied to the sums, so totals match the Billing Report's group
+        rows. Returns a frame with columns Month, Billing Group, Accounts and
+        METRIC_COLUMNS.
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT month, billing_group, COUNT(*), {_metric_sums_sql} "
+                "FROM usage_history WHERE month BETWEEN ? AND ? "
+                "GROUP BY month, billing_group ORDER BY month",
+                (month_key(first_month), month_key(last_month))
+            ).fetchall()
+        totals = pd.DataFrame(rows, columns=['Month', 'Billing Group', 'Accounts'] + METRIC_COLUMNS)
+
+        if rules is None:
+            rules = get_billing_rules()
+        for metric, factors in rules['multipliers'].items():
+            totals[metric] = totals[metric] * totals['Billing Group'].map(factors).fillna(1)
+        return totals
+
+    def previous_month(self, month):
+        """Latest recorded month before month, or None"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT MAX(month) FROM usage_history WHERE month < ?", (month_key(month),)
+            ).fetchone()
+        return row[0]
+
+    def month_over_month(self, month):
+        """Compare month with the previous recorded month, per billing group and metric
+
+        Returns a long table with columns Billing Group, Metric, Previous,
+        Current, Change and Change % (NaN where the previous value is 0).
+        """
+        month = month_key(month)
+        previous = self.previous_month(month) or month
+        totals = self.group_totals(previous, month).drop(columns='Accounts')
+        long = totals.melt(id_vars=['Month', 'Billing Group'], var_name='Metric')
+        table = long.pivot_table(index=['Billing Group', 'Metric'], columns='Month', values='value', sort=False)
+
+        no_values = pd.Series(0.0, index=table.index)
+        comparison = pd.DataFrame({
+            'Previous': table[previous] if previous != month else no_values,
+            'Current': table[month] if month in table.columns else no_values
+        }).fillna(0.0)
+        comparison['Change'] = comparison['Current'] - comparison['Previous']
+        comparison['Change %'] = (comparison['Change'] / comparison['Previous'].where(comparison['Previous'] != 0) * 100).round(1)
+        return _in_report_order(comparison.reset_index())
+
+    def trailing_months(self, month, count=12):
+        """Per-group metric totals for the count months ending at month
+
+        Returns a table with Billing Group and Metric columns, one column per
+        recorded month in the window, then Total and Monthly Average.
+        """
+        last = pd.Period(month_key(month), freq='M')
+        first = last - (count - 1)
+        totals = self.group_totals(first, last).drop(columns='Accounts')
+        long = totals.melt(id_vars=['Month', 'Billing Group'], var_name='Metric')
+        table = long.pivot_table(index=['Billing Group', 'Metric'], columns='Month', values='value', sort=False).fillna(0.0)
+        table.columns.name = None
+
+        months = list(table.columns)
+        table['Total'] = table[months].sum(axis=1)
+        table['Monthly Average'] = table['Total'] / max(len(months), 1)
+        return _in_report_order(table.reset_index())
+
+def _in_report_order(table):
+    """Sort a group x metric table by report group order, then metric order"""
+    group_rank = {group: rank for rank, group in enumerate(BILLING_GROUP_ORDER)}
+    metric_rank = {metric: rank for rank, metric in enumerate(METRIC_COLUMNS)}
+    order = pd.DataFrame({
+        'group': table['Billing Group'].map(group_rank).fillna(len(group_rank)),
+        'name': table['Billing Group'],
+        'metric': table['Metric'].map(metric_rank)
+    })
+    return table.loc[order.sort_values(['group', 'name', 'metric'], kind='stable').index].reset_index(drop=True)
+
+def write_history_sheet(workbook, store, month, header_format, group_format):
+    """Add a 'Month over Month' sheet comparing month with earlier recorded months
+
+    Writes the month-over-month table followed by the trailing-12-month
+    table. Returns False (and adds nothing) if month is not recorded.
+    """
+    month = month_key(month)
+    if month not in store.months():
+        return False
+
+    worksheet = workbook.add_worksheet('Month over Month')
+    percent_format = workbook.add_format({'num_format': '0.0"%"'})
+    row = 0
+
+    for title, table in (
+        (f'Month over Month - {month}', store.month_over_month(month)),
+        (f'Trailing 12 Months - {month}', store.trailing_months(month))
+    ):
+        worksheet.merge_range(row, 0, row, len(table.columns) - 1, title, header_format)
+        row += 2
+        worksheet.write_row(row, 0, list(table.columns), header_format)
+        row += 1
+        for values in table.itertuples(index=False, name=None):
+            cells = ['' if pd.isna(value) else value for value in values]
+            worksheet.write(row, 0, cells[0], group_format)
+            worksheet.write_row(row, 1, cells[1:])
+            if 'Change %' in table.columns:
+                worksheet.write(row, table.columns.get_loc('Change %'), cells[-1], percent_format)
+            row += 1
+        row += 2
+
+    worksheet.set_column(0, 0, 22)
+    worksheet.set_column(1, 1, 22)
+    worksheet.set_column(2, 20, 14)
+    return True
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+def get_history_store(db_path=HISTORY_DB):
+    """Return the process-wide history store for db_path, opening it on first use"""
+    key = os.path.abspath(db_path)
+    with _stores_lock:
+        if key not in _stores:
+            _stores[key] = HistoryStore(db_path)
+        return _stores[key]
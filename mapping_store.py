@@ -0,0 +1,154 @@
+"""
+Account Mapping Store
+SQLite-backed account to billing group mappings with an in-process read cache
+"""
+
+import json
+import os
+import sqlite3
+import threading
+
+MAPPINGS_DB = 'account_group_mappings.db'
+MAPPINGS_JSON = 'account_group_mappings.json'
+
+UPSERT_MAPPING_SQL = (
+    "INSERT INTO mappings (account, billing_group) VALUES (?, ?) "
+    "ON CONFLICT(account) DO UPDATE SET billing_group = excluded.billing_group"
+)
+
+class MappingStore:
+    """Account to billing group mappings kept in an indexed SQLite table
+
+    Every write bumps a version counter in the same transaction. Reads are
+    served from an in-process dict that is only rebuilt when the stored
+    version changes, so a rerun costs one primary-key lookup. The legacy JSON
+    file is imported the first time the database is created and can be
+    regenerated at any time with export_json.
+    """
+
+    def __init__(self, db_path=MAPPINGS_DB, json_path=MAPPINGS_JSON):
+        self.db_path = db_path
+        self.json_path = json_path
+        self._lock = threading.Lock()
+        self._mappings = {}
+        self._cached_version = None
+        self._export = None
+        self._export_version = None
+
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        with self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS mappings ("
+                "account TEXT PRIMARY KEY, "
+                "billing_group TEXT NOT NULL"
+                ") WITHOUT ROWID"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_mappings_group ON mappings (billing_group)")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+            self._conn.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('version', 0)")
+        self._import_json_once()
+
+    def _import_json_once(self):
+        """Import the legacy JSON mappings file into an empty database"""
+        with self._lock:
+            imported = self._conn.execute("SELECT value FROM meta WHERE key = 'json_imported'").fetchone()
+            if imported:
+                return
+
+            try:
+                with open(self.json_path, 'r') as f:
+                    mappings = json.load(f)
+            except (FileNotFoundError, json.JSONDecodeError):
+                mappings = {}
+
+            with self._conn:
+                self._conn.executemany(
+                    "INSERT OR IGNORE INTO mappings (account, billing_group) VALUES (?, ?)",
+                    [(str(account), group) for account, group in mappings.items()]
+                )
+                self._conn.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('json_imported', 1)")
+                self._bump_version()
+
+    def _bump_version(self):
+        """Increment the version counter; call inside a write transaction"""
+        self._conn.execute("UPDATE meta SET value = value + 1 WHERE key = 'version'")
+
+    def version(self):
+        """Current mappings version, changes on every write from any process"""
+        with self._lock:
+            return self._conn.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()[0]
+
+    def load(self):
+        """Return all mappings as {account: group}
+
+        The dict is shared between callers until the next write; treat it as read-only.
+        """
+        version = self.version()
+        with self._lock:
+            if version != self._cached_version:
+                rows = self._conn.execute("SELECT account, billing_group FROM mappings")
+                self._mappings = dict(rows.fetchall())
+                self._cached_version = version
+            return self._mappings
+
+    def assign_account(self, account, group):
+        """Insert or update a single account mapping"""
+        with self._lock, self._conn:
+            self._conn.execute(UPSERT_MAPPING_SQL, (str(account), group))
+            self._bump_version()
+
+    def assign_accounts(self, assignments):
+        """Insert or update many account mappings in a single transaction"""
+        if not assignments:
+            return
+        with self._lock, self._conn:
+            self._conn.executemany(
+                UPSERT_MAPPING_SQL,
+                [(str(account), group) for account, group in assignments.items()]
+            )
+            self._bump_version()
+
+    def replace_all(self, mappings):
+        """Make the stored mappings equal to mappings, writing only the differences"""
+        current = dict(self.load())
+        mappings = {str(account): group for account, group in mappings.items()}
+        changed = [(account, group) for account, group in mappings.items() if current.get(account) != group]
+        removed = [(account,) for account in current if account not in mappings]
+        if not changed and not removed:
+            return
+
+        with self._lock, self._conn:
+            self._conn.executemany(UPSERT_MAPPING_SQL, changed)
+            self._conn.executemany("DELETE FROM mappings WHERE account = ?", removed)
+            self._bump_version()
+
+    def group_counts(self):
+        """Number of mapped accounts per billing group"""
+        with self._lock:
+            rows = self._conn.execute("SELECT billing_group, COUNT(*) FROM mappings GROUP BY billing_group")
+            return dict(rows.fetchall())
+
+    def export_json(self, path=None):
+        """Write the mappings in the legacy JSON format and return the JSON text"""
+        mappings = self.load()
+        with self._lock:
+            if self._export_version != self._cached_version:
+                self._export = json.dumps(mappings, indent=2)
+                self._export_version = self._cached_version
+            data = self._export
+        if path:
+            with open(path, 'w') as f:
+                f.write(data)
+        return data
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+def get_mapping_store(db_path=MAPPINGS_DB, json_path=MAPPINGS_JSON):
+    """Return the process-wide store for db_path, opening it on first use"""
+    key = os.path.abspath(db_path)
+    with _stores_lock:
+        if key not in _stores:
+            _stores[key] = MappingStore(db_path, json_path)
+        return _stores[key]
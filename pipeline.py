@@ -0,0 +1,143 @@
+"""
+Billing Pipeline
+Lazy, memoized processing stages for one session's upload
+
+    ingest -> normalize -> map -> aggregate -> render
+
+Each stage is computed on first access from the stages before it and kept
+until one of the inputs it depends on changes. Inputs invalidate the first
+stage that reads them and everything downstream: a new upload (source)
+invalidates every stage, a rules change starts again from normalize, a
+mapping change from map (the parsed frame is kept) and report options
+(title month, history month) only the render stage.
+
+Assigning a few accounts need not recompute map and aggregate at all:
+apply_assignments patches them for just the changed accounts.
+"""
+
+import threading
+
+from billing_engine import reassign_accounts
+
+PIPELINE_STAGES = ('ingest', 'normalize', 'map', 'aggregate', 'render')
+
+# First stage that reads each input
+INPUT_STAGES = {
+    'source': 'ingest',
+    'rules': 'normalize',
+    'mappings': 'map',
+    'report': 'render'
+}
+
+class BillingPipeline:
+    """Memoized stage values for the current inputs
+
+    compute maps each stage name to a function taking the pipeline, which
+    reads its inputs with input() and upstream results with get(). Keep one
+    pipeline per session (in st.session_state); stage functions can still
+    share work across sessions through result_cache with version() keys.
+    """
+
+    def __init__(self, compute):
+        self._compute = compute
+        self._inputs = {}
+        self._values = {}
+        self._lock = threading.RLock()
+
+    def set_input(self, name, version, value=None):
+        """Set an input, invalidating its stages if the version changed
+
+        The value is replaced even when the version is unchanged, so the
+        pipeline refers to this run's objects (e.g. the current UploadedFile)
+        rather than keeping an earlier run's alive. Returns True if anything
+        was invalidated.
+        """
+        with self._lock:
+            changed = name not in self._inputs or self._inputs[name][0] != version
+            self._inputs[name] = (version, value)
+            if changed:
+                self.invalidate(INPUT_STAGES[name])
+            return changed
+
+    def update_input(self, name, version, value, patches):
+        """Change an input, patching memoized stages instead of recomputing them
+
+        patches maps stage names to functions taking the stage's current
+        value and returning its value for the new input; they are applied to
+        the stages that are memoized, and every other invalidated stage is
+        dropped as in set_input.
+        """
+        with self._lock:
+            patched = {stage: patch(self._values[stage]) for stage, patch in patches.items() if stage in self._values}
+            self._inputs[name] = (version, value)
+            self.invalidate(INPUT_STAGES[name])
+            self._values.update(patched)
+
+    def has_input(self, name):
+        return name in self._inputs
+
+    def input(self, name):
+        """Current value of an input; KeyError if it was never set"""
+        return self._inputs[name][1]
+
+    def version(self, *names):
+        """Versions of the named inputs, for cache keys"""
+        with self._lock:
+            return tuple(self._inputs[name][0] if name in self._inputs else None for name in names)
+
+    def get(self, stage):
+        """Stage value, computed on first access and memoized until invalidated
+
+        A stage that raises is not memoized and is computed again on the next access.
+        """
+        with self._lock:
+            if stage not in self._values:
+                self._values[stage] = self._compute[stage](self)
+            return self._values[stage]
+
+    def is_computed(self, stage):
+        with self._lock:
+            return stage in self._values
+
+    def invalidate(self, stage):
+        """Drop a stage and every stage downstream of it"""
+        with self._lock:
+            for name in PIPELINE_STAGES[PIPELINE_STAGES.index(stage):]:
+                self._values.pop(name, None)
+
+    def release(self, stage):
+        """Drop only this stage's value to free memory; downstream values are kept
+
+        The stage is recomputed if it is needed again.
+        """
+        with self._lock:
+            self._values.pop(stage, None)
+
+    def clear(self):
+        """Forget every input and stage value"""
+        with self._lock:
+            self._inputs.clear()
+            self._values.clear()
+
+def apply_assignments(pipeline, assignments, version, mappings):
+    """Move the pipeline to new mappings by patching map and aggregate for the assigned accounts
+
+    Only valid when assignments are the sole change from the pipeline's
+    current mappings to mappings (at version). Assigned accounts drop out
+    of the map stage, group totals move from each account's old group to
+    its new one, and only the render stage is rebuilt.
+    """
+    previous = pipeline.input('mappings')
+    changes = {
+        account: (previous.get(account), group)
+        for account, group in assignments.items() if previous.get(account) != group
+    }
+
+    def patch_map(new_accounts):
+        return [account for account in new_accounts if account not in assignments]
+
+    def patch_aggregate(aggregate):
+        df, account_index = pipeline.get('normalize')
+        return reassign_accounts(aggregate, df, account_index, changes)
+
+    pipeline.update_input('mappings', version, mappings, {'map': patch_map, 'aggregate': patch_aggregate})
@@ -0,0 +1,137 @@
+"""
+Report Jobs
+Background report generation on a worker pool shared by every session
+
+Workbooks are built off the Streamlit script thread, so reruns (assigning an
+account, saving history) never wait for a report. Finished reports go into
+the shared result cache under the same version key the apps already use.
+"""
+
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from billing_engine import result_cache
+from diagnostics import start_recording, stop_recording
+
+REPORT_WORKERS = 2
+
+class ReportJob:
+    """A report build submitted to the shared pool
+
+    The build runs under its own diagnostics recorder, so progress is the
+    share of the expected stages whose spans have finished.
+    """
+
+    def __init__(self, key, stages=()):
+        self.key = key
+        self.stages = list(stages)
+        self.future = Future()
+        self.recorder = None
+        self.started = time.perf_counter()
+
+    @classmethod
+    def finished(cls, key, value):
+        """A job for a result that is already available"""
+        job = cls(key)
+        job.future.set_result(value)
+        return job
+
+    def done(self):
+        return self.future.done()
+
+    def error(self):
+        """The exception the build raised, or None while running or on success"""
+        return self.future.exception() if self.done() else None
+
+    def result(self):
+        """The build's return value; re-raises any error from the build"""
+        return self.future.result()
+
+    def spans(self):
+        """Diagnostics spans recorded by the build so far"""
+        return list(self.recorder.spans) if self.recorder is not None else []
+
+    def progress(self):
+        """Fraction of the expected stages completed, between 0 and 1"""
+        if self.done():
+            return 1.0
+        if not self.stages:
+            return 0.0
+        finished = {record['stage'] for record in self.spans()}
+        return sum(stage in finished for stage in self.stages) / len(self.stages)
+
+    def current_stage(self):
+        """First expected stage that has not finished yet, or None"""
+        finished = {record['stage'] for record in self.spans()}
+        return next((stage for stage in self.stages if stage not in finished), None)
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+class ReportJobs:
+    """Report builds keyed like result_cache entries, one build per key
+
+    Successful results are handed to the cache and the job is dropped, so a
+    later submit for the same key returns a finished job at once. Failed
+    builds (and results too large to cache) stay registered until discarded,
+    which keeps a page from resubmitting the same failing build every rerun.
+    """
+
+    def __init__(self, max_workers=REPORT_WORKERS, cache=result_cache):
+        self.cache = cache
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='billing-report')
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def submit(self, key, build, stages=()):
+        """Return the job for key, starting build on the pool if nothing is cached or running
+
+        stages are the diagnostics span names build records, used for progress.
+        """
+        with self._lock:
+            job = self._jobs.get(key)
+            if job is not None:
+                return job
+            value = self.cache.get(key)
+            if value is not None:
+                return ReportJob.finished(key, value)
+
+            job = ReportJob(key, stages)
+            self._jobs[key] = job
+        self._executor.submit(self._run, job, build)
+        return job
+
+    def get(self, key):
+        """The running, failed or finished job for key, or None if it was never submitted (or evicted)"""
+        with self._lock:
+            job = self._jobs.get(key)
+            if job is not None:
+                return job
+            value = self.cache.get(key)
+        return None if value is None else ReportJob.finished(key, value)
+
+    def discard(self, key):
+        """Forget a finished job so the next submit builds it again"""
+        with self._lock:
+            job = self._jobs.get(key)
+            if job is not None and job.done():
+                del self._jobs[key]
+
+    def _run(self, job, build):
+        job.recorder = start_recording()
+        try:
+            value = build()
+        except Exception as e:
+            job.future.set_exception(e)
+            return
+        finally:
+            stop_recording()
+
+        with self._lock:
+            if self.cache.put(job.key, value):
+                del self._jobs[job.key]
+        job.future.set_result(value)
+
+# Shared across reruns and sessions within one server process
+report_jobs = ReportJobs()
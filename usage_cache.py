@@ -0,0 +1,110 @@
+"""
+Usage Cache
+Validated, normalized usage frames persisted as Parquet files keyed by upload content hash
+"""
+
+import json
+import os
+import tempfile
+
+from billing_rules import billing_rules_version
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # optional; without pyarrow every upload is parsed from source
+    pa = None
+
+USAGE_CACHE_DIR = '.usage_cache'
+
+# Frame attrs that survive the round trip (see billing_engine.normalize_metrics)
+CACHED_ATTRS = ('normalized', 'input_totals', 'memory_bytes', 'merged_rows', 'added_columns')
+
+# Bumped when the stored frame layout changes (2: compact dtypes, 3: duplicate accounts merged,
+# 4: streamed summaries no longer re-derive Transcription Minutes)
+CACHE_FORMAT = 4
+
+def _json_default(value):
+    return value.item()
+
+def cache_key(source, data_version, summary=False):
+    """File key for a parsed upload
+
+    source names the validator that produced the frame ('app' or
+    'standalone'); summary marks a streamed per-account summary. The billing
+    rules version is included because normalization applies the rules.
+    """
+    return f"{source}-{'summary' if summary else 'full'}-v{CACHE_FORMAT}-{billing_rules_version()}-{data_version}"
+
+class UsageCache:
+    """Directory of Parquet files holding normalized, typed usage frames
+
+    A frame is written once per distinct upload and read back instead of
+    re-parsing the CSV or XLSX. Reads can be limited to the columns a report
+    needs. Does nothing if pyarrow is not installed or a frame has columns
+    Arrow cannot type.
+    """
+
+    def __init__(self, cache_dir=USAGE_CACHE_DIR):
+        self.cache_dir = cache_dir
+
+    @property
+    def enabled(self):
+        return pa is not None
+
+    def path(self, key):
+        return os.path.join(self.cache_dir, f'{key}.parquet')
+
+    def load(self, key, columns=None):
+        """Return the cached frame for key, or None on a miss
+
+        columns limits the read to those columns; names missing from the file are ignored.
+        """
+        if not self.enabled:
+            return None
+        path = self.path(key)
+        try:
+            parquet_file = pq.ParquetFile(path)
+        except (FileNotFoundError, pa.ArrowException):
+            return None
+
+        schema = parquet_file.schema_arrow
+        if columns is not None:
+            columns = [col for col in columns if col in schema.names]
+        df = parquet_file.read(columns=columns).to_pandas()
+
+        metadata = schema.metadata or {}
+        if b'billing_attrs' in metadata:
+            df.attrs.update(json.loads(metadata[b'billing_attrs']))
+        return df
+
+    def store(self, key, df):
+        """Write df under key; returns False if it could not be cached"""
+        if not self.enabled:
+            return False
+        try:
+            table = pa.Table.from_pandas(df, preserve_index=False)
+        except pa.ArrowException:
+            return False
+
+        attrs = {name: df.attrs[name] for name in CACHED_ATTRS if name in df.attrs}
+        metadata = dict(table.schema.metadata or {})
+        metadata[b'billing_attrs'] = json.dumps(attrs, default=_json_default).encode()
+        table = table.replace_schema_metadata(metadata)
+
+        # Write to a temp file and rename so readers never see a partial file
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            fd, temp_path = tempfile.mkstemp(suffix='.parquet.tmp', dir=self.cache_dir)
+            os.close(fd)
+        except OSError:
+            return False
+        try:
+            pq.write_table(table, temp_path)
+            os.replace(temp_path, self.path(key))
+        except OSError:
+            os.remove(temp_path)
+            return False
+        return True
+
+usage_cache = UsageCache()